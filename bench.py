@@ -0,0 +1,294 @@
+"""Бенчмарк пошукового стека: синтетичний PDF-корпус, збірка/завантаження індексу, латентність пошуку
+    і холодний старт (time-to-first-query зі store/ і зі знімка snapshot.py).
+
+    python bench.py corpus --pages 2000                 # лише згенерувати корпус
+    python bench.py run --pages 2000 --out new.json     # корпус (якщо ще нема) + заміри
+    python bench.py run --baseline old.json             # те саме + порівняння, код 1 при регресії
+    python bench.py compare old.json new.json
+
+Кожна фаза йде в окремому процесі, тож пікова пам'ять і час завантаження міряються з холодного старту.
+"""
+import os
+import sys
+import json
+import html
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+from typing import Dict, List
+
+import numpy as np
+
+BENCH_DIR = "bench_data"
+TOLERANCE = 0.15   # допустиме погіршення метрики між двома прогонами (15%)
+
+UK_LETTERS = "абвгґдеєжзиіїйклмнопрстуфхцчшщьюя"
+EN_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+# реальні слова з документів бота — щоб частина запитів мала сенс
+DOMAIN_WORDS = ["звіт", "склад", "прийом", "товару", "трансфер", "каса", "мінусовий", "сток",
+                "kpi", "lcm", "cover", "turnover", "sample", "counting", "x/z", "№35", "e-learning"]
+PUNCT = [",", ".", ":", ";", ")", "»"]
+
+# ---------- корпус ----------
+def make_vocab(size: int, uk_share: float, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    words, seen = list(DOMAIN_WORDS), set(DOMAIN_WORDS)
+    while len(words) < size:
+        letters = UK_LETTERS if rng.random() < uk_share else EN_LETTERS
+        w = "".join(rng.choice(list(letters), int(rng.integers(2, 11))))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    order = rng.permutation(len(words))   # доменні слова — не обов'язково найчастіші
+    return [words[i] for i in order]
+
+def zipf_weights(n: int, s: float = 1.07) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+def make_corpus(root: str, pages: int, pdf_pages: int = 50, vocab: int = 20000, uk_share: float = 0.6,
+                words: int = 300, seed: int = 1) -> Dict:
+    """PDF-и в <root>/docs з текстом за законом Ципфа. Повторний виклик з тими самими
+    параметрами нічого не генерує (параметри лежать у <root>/corpus.json)."""
+    import fitz  # PyMuPDF
+    params = {"pages": pages, "pdf_pages": pdf_pages, "vocab": vocab, "uk_share": uk_share,
+              "words": words, "seed": seed}
+    meta_path = os.path.join(root, "corpus.json")
+    docs = os.path.join(root, "docs")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == params:
+                return params
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(docs)
+    terms = make_vocab(vocab, uk_share, seed)
+    p = zipf_weights(len(terms))
+    rng = np.random.default_rng(seed + 1)
+    t0 = time.perf_counter()
+    for d in range(0, pages, pdf_pages):
+        doc = fitz.open()
+        for _ in range(min(pdf_pages, pages - d)):
+            n = int(rng.integers(words // 2, words * 3 // 2))
+            toks = [terms[i] for i in rng.choice(len(terms), n, p=p)]
+            for i in np.flatnonzero(rng.random(n) < 0.1):
+                toks[i] += PUNCT[int(rng.integers(len(PUNCT)))]
+            page = doc.new_page()
+            page.insert_htmlbox(page.rect + (36, 36, -36, -36), html.escape(" ".join(toks)),
+                                css="* {font-size: 9px;}")
+        doc.subset_fonts()
+        doc.save(os.path.join(docs, f"bench_{d // pdf_pages:04}.pdf"), garbage=4, deflate=True)
+    with open(meta_path, "w") as f:
+        json.dump(params, f)
+    print(f"[bench] corpus: {pages} pages in {time.perf_counter() - t0:.1f}s -> {docs}", flush=True)
+    return params
+
+def make_queries(n: int, vocab: int, uk_share: float, seed: int) -> List[str]:
+    """1–3 слова: частотні, середні й рідкісні терміни корпусу вперемішку."""
+    terms = make_vocab(vocab, uk_share, seed)
+    rng = np.random.default_rng(seed + 2)
+    p = zipf_weights(len(terms), 0.7)   # пологіше за корпус — більше рідкісних слів
+    return [" ".join(terms[i] for i in rng.choice(len(terms), int(rng.integers(1, 4)), p=p)) for _ in range(n)]
+
+# ---------- фази (в окремому процесі) ----------
+def _mb(v: int) -> float:
+    return round(v / 2**20, 1)
+
+def phase_build(workers: int) -> Dict:
+    import retriever_lite as R
+    shutil.rmtree("store", ignore_errors=True)
+    os.makedirs("store")
+    t0 = time.perf_counter()
+    idx = R.build_index(workers=workers)
+    dt = time.perf_counter() - t0
+    return {"seconds": round(dt, 3), "pages": len(idx), "passages": idx.n, "workers": workers,
+            "pages_per_sec": round(len(idx) / dt, 1), "peak_rss_mb": _mb(R._rss("VmHWM")),
+            "store_mb": _mb(sum(e.stat().st_size for e in os.scandir(R.SEGMENTS_DIR))),
+            "positions_mb": _mb(sum(s.positions_nbytes() for s in idx.segments.values()))}
+
+def phase_search(queries: List[str], k: int) -> Dict:
+    import retriever_lite as R
+    rss0 = R._rss()
+    t0 = time.perf_counter()
+    idx = R.load_index()
+    idx.stats()
+    load = time.perf_counter() - t0
+    toks = [R.tokenize(q) for q in queries]
+    for q in toks[:20]:   # прогрів: кеш термінів, межі MaxScore, сторінки mmap
+        idx._search(q, k)
+    lat = []
+    t0 = time.perf_counter()
+    for q in toks:   # повз query_cache — міряється сам пошук
+        t = time.perf_counter()
+        idx._search(q, k)
+        lat.append(time.perf_counter() - t)
+    total = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    idx._search_many(toks, k)
+    batch = time.perf_counter() - t0
+    ms = np.array(lat) * 1000
+    mem = idx.memory_stats()
+    return {"load_seconds": round(load, 4), "queries": len(queries), "k": k,
+            "p50_ms": round(float(np.percentile(ms, 50)), 3), "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3), "qps": round(len(queries) / total, 1),
+            "batch_qps": round(len(queries) / batch, 1), "peak_rss_mb": _mb(R._rss("VmHWM")),
+            "index_rss_mb": _mb(R._rss() - rss0), "index_heap_mb": _mb(mem["heap_bytes"]),
+            "index_mapped_mb": _mb(mem["mapped_bytes"])}
+
+def phase_coldstart(mode: str, query: str) -> Dict:
+    """Холодний старт API у свіжому процесі: імпорт retriever_lite, відкриття індексу, прогрів
+    і перший запит. store — індекс уже на диску; snapshot — порожній store/, сегменти зі знімка."""
+    if mode == "snapshot":
+        shutil.rmtree("store", ignore_errors=True)
+    t0 = time.perf_counter()
+    import retriever_lite as R
+    t1 = time.perf_counter()
+    idx = R.ensure_index()
+    t2 = time.perf_counter()
+    idx.warm()
+    t3 = time.perf_counter()
+    idx.search(query)
+    t4 = time.perf_counter()
+    return {"import_seconds": round(t1 - t0, 4), "fitz_imported": "fitz" in sys.modules,
+            "open_seconds": round(t2 - t1, 4), "warm_seconds": round(t3 - t2, 4),
+            "ready_seconds": round(t3 - t0, 4), "first_query_ms": round((t4 - t3) * 1000, 3)}
+
+def _run(root: str, script: str, *args) -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, os.path.join(here, script), *args],
+                         cwd=root, env=env, capture_output=True, text=True)
+    if out.returncode:
+        sys.stderr.write(out.stdout + out.stderr)
+        raise SystemExit(f"[bench] {script} {args[0]} failed with code {out.returncode}")
+    return out.stdout
+
+def _run_phase(root: str, *args) -> Dict:
+    """Фаза в чистому інтерпретаторі; результат — останній рядок stdout у JSON."""
+    return json.loads(_run(root, "bench.py", "phase", *args).strip().splitlines()[-1])
+
+def coldstart(root: str, workers: int) -> Dict:
+    """Time-to-first-query зі store/ і зі знімка. Знімок складається з сегментів, щойно зібраних
+    фазою build (snapshot.py бере їх за sha1), тож тут міряється саме старт, а не повторна збірка."""
+    store = _run_phase(root, "coldstart", "store", DOMAIN_WORDS[0])
+    shutil.rmtree(os.path.join(root, "snapshot"), ignore_errors=True)
+    shutil.copytree(os.path.join(root, "store", "segments"), os.path.join(root, "snapshot", "segments"))
+    _run(root, "snapshot.py", "build", "--workers", str(workers))
+    snap = _run_phase(root, "coldstart", "snapshot", DOMAIN_WORDS[0])
+    return {"import_seconds": store["import_seconds"], "fitz_imported": store["fitz_imported"],
+            "store_ready_seconds": store["ready_seconds"], "store_first_query_ms": store["first_query_ms"],
+            "snapshot_ready_seconds": snap["ready_seconds"], "snapshot_open_seconds": snap["open_seconds"],
+            "snapshot_first_query_ms": snap["first_query_ms"]}
+
+def run(args) -> Dict:
+    corpus = make_corpus(args.dir, args.pages, args.pdf_pages, args.vocab, args.uk_share, args.words, args.seed)
+    build = _run_phase(args.dir, "build", str(args.workers))
+    print(f"[bench] build: {build}", flush=True)
+    search = _run_phase(args.dir, "search", str(args.queries), str(args.k))
+    print(f"[bench] search: {search}", flush=True)
+    cold = coldstart(args.dir, args.workers)
+    print(f"[bench] coldstart: {cold}", flush=True)
+    import fitz
+    return {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                     "numpy": np.__version__, "pymupdf": fitz.VersionBind, "machine": platform.machine(),
+                     "cpus": os.cpu_count(), "commit": _git_commit()},
+            "corpus": corpus, "build": build, "search": search, "coldstart": cold}
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+# ---------- порівняння ----------
+# (секція, метрика, чим менше — тим краще)
+METRICS = [
+    ("build", "seconds", True), ("build", "peak_rss_mb", True), ("build", "store_mb", True),
+    ("search", "load_seconds", True), ("search", "p50_ms", True), ("search", "p95_ms", True),
+    ("search", "p99_ms", True), ("search", "qps", False), ("search", "batch_qps", False),
+    ("search", "peak_rss_mb", True), ("search", "index_rss_mb", True),
+    ("coldstart", "import_seconds", True), ("coldstart", "store_ready_seconds", True),
+    ("coldstart", "snapshot_ready_seconds", True), ("coldstart", "store_first_query_ms", True),
+]
+
+def compare(old: Dict, new: Dict, tolerance: float = TOLERANCE) -> List[str]:
+    """Друкує таблицю змін; повертає список регресій (погіршення більше за tolerance)."""
+    if old.get("corpus") != new.get("corpus"):
+        print(f"[warn] different corpora: {old.get('corpus')} vs {new.get('corpus')}")
+    bad = []
+    for sec, key, lower in METRICS:
+        a, b = old.get(sec, {}).get(key), new.get(sec, {}).get(key)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else 0.0
+        worse = change > tolerance if lower else change < -tolerance
+        # для дрібних значень шум таймера більший за поріг — потрібна й абсолютна різниця
+        worse = worse and abs(b - a) > (0.05 if key.endswith("_ms") else 0.0)
+        print(f"{'REGRESSION' if worse else 'ok':>10}  {sec}.{key:<14} {a:>10} -> {b:<10} ({change:+.1%})")
+        if worse:
+            bad.append(f"{sec}.{key}: {a} -> {b} ({change:+.1%})")
+    return bad
+
+def _load(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Retrieval benchmark for retriever_lite")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("corpus", "run"):
+        p = sub.add_parser(name)
+        p.add_argument("--dir", default=BENCH_DIR)
+        p.add_argument("--pages", type=int, default=2000)
+        p.add_argument("--pdf-pages", type=int, default=50)
+        p.add_argument("--vocab", type=int, default=20000)
+        p.add_argument("--uk-share", type=float, default=0.6, help="частка українських слів у словнику")
+        p.add_argument("--words", type=int, default=300, help="середня кількість слів на сторінці")
+        p.add_argument("--seed", type=int, default=1)
+        if name == "run":
+            p.add_argument("--workers", type=int, default=1)
+            p.add_argument("--queries", type=int, default=500)
+            p.add_argument("-k", type=int, default=6)
+            p.add_argument("--out", default="", help="куди записати JSON результатів")
+            p.add_argument("--baseline", default="", help="JSON попереднього прогону для порівняння")
+            p.add_argument("--tolerance", type=float, default=TOLERANCE)
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--tolerance", type=float, default=TOLERANCE)
+    p = sub.add_parser("phase")   # внутрішня: одна фаза в окремому процесі
+    p.add_argument("name", choices=["build", "search", "coldstart"])
+    p.add_argument("args", nargs="*")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "corpus":
+        make_corpus(args.dir, args.pages, args.pdf_pages, args.vocab, args.uk_share, args.words, args.seed)
+    elif args.cmd == "phase":
+        if args.name == "build":
+            res = phase_build(int(args.args[0]))
+        elif args.name == "coldstart":
+            res = phase_coldstart(*args.args)
+        else:
+            with open("corpus.json") as f:
+                c = json.load(f)
+            res = phase_search(make_queries(int(args.args[0]), c["vocab"], c["uk_share"], c["seed"]), int(args.args[1]))
+        print(json.dumps(res))
+    elif args.cmd == "run":
+        res = run(args)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(res, f, indent=2)
+            print(f"[bench] results -> {args.out}")
+        if args.baseline:
+            bad = compare(_load(args.baseline), res, args.tolerance)
+            if bad:
+                raise SystemExit(f"[bench] {len(bad)} regression(s): " + "; ".join(bad))
+    else:
+        bad = compare(_load(args.old), _load(args.new), args.tolerance)
+        if bad:
+            raise SystemExit(f"[bench] {len(bad)} regression(s): " + "; ".join(bad))
+
+if __name__ == "__main__":
+    main()
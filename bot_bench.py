@@ -0,0 +1,438 @@
+"""Навантажувальний тест бота: локальна заглушка Bot API (+ API_BASE) і програвання сценаріїв апдейтів
+через справжній Application з bot_telegram — як персонал магазинів на початку зміни тисне кнопки.
+
+    python bot_bench.py run --users 50 --steps 12 --out bot.json     # згенерований сценарій
+    python bot_bench.py script --users 50 --out burst.jsonl          # лише записати сценарій
+    python bot_bench.py run --script burst.jsonl --tg-latency 0.05
+    python bot_bench.py fake --port 8081     # сама заглушка: TELEGRAM_API_BASE=API_BASE=http://127.0.0.1:8081
+
+Апдейти бот забирає через getUpdates, як у продакшені. Кожен користувач — окремий чат, що чекає
+відповіді на попередню дію (і --think секунд) перед наступною. Звіт: затримка від відправки апдейту
+до кінця його обробки (перцентилі), з неї — час у черзі й у хендлері; апдейтів за секунду; виклики
+Bot API на апдейт (за chat_id / callback_query_id / file_id) і виклики API_BASE загалом.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import subprocess
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+BOT_BENCH_DIR = "bot_bench_data"
+FAKE_PORT = 8089
+FAKE_TOKEN = "123456:bench"
+UPDATE_TIMEOUT = 60.0
+
+# ---------- заглушка Bot API і API_BASE ----------
+def _fake_pdf() -> bytes:
+    import fitz
+    doc = fitz.open()
+    for i in range(3):
+        doc.new_page().insert_text((72, 72), f"bench upload page {i + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def fake_app(tg_latency: float = 0.0, api_latency: float = 0.0):
+    """FastAPI-застосунок: методи Bot API, які кличе бот, і /files-list, /search, /ingest з API.
+    /_updates — черга для getUpdates, /_calls — журнал вихідних викликів."""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, Response
+    import bot_telegram as B
+
+    app = FastAPI()
+    pending: List[Dict] = []
+    arrived = asyncio.Event()
+    calls: List[Dict] = []
+    seq = iter(range(1, 1 << 62))
+    pdf = _fake_pdf()
+    names = sorted(set(B.FILES_DOCS.values()) | set(B.PROMO_DOCS.values()))
+    files = [{"name": n, "url": f"/files/{n}", "sha1": hashlib.sha1(n.encode()).hexdigest()} for n in names]
+    etag = '"' + hashlib.sha1(json.dumps(files).encode()).hexdigest()[:16] + '"'
+    me = {"id": int(FAKE_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+          "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": True}
+
+    def log(method, kind, **kw):
+        calls.append({"m": method, "kind": kind, "t": time.time(), **kw})
+
+    def message(chat_id, **extra):
+        return {"message_id": next(seq), "date": int(time.time()), "from": me,
+                "chat": {"id": int(chat_id), "type": "private"}, **extra}
+
+    @app.post("/_updates")
+    async def push(request: Request):
+        pending.extend((await request.json())["updates"])
+        arrived.set()
+        return {"ok": True}
+
+    @app.get("/_calls")
+    def journal():
+        return {"calls": calls}
+
+    @app.post("/bot{token}/{method}")
+    async def bot_api(token: str, method: str, request: Request):
+        form = await request.form()
+        if method == "getUpdates":
+            offset, timeout = int(form.get("offset") or 0), float(form.get("timeout") or 0)
+            pending[:] = [u for u in pending if u["update_id"] >= offset]
+            if not pending:
+                arrived.clear()
+                try:
+                    await asyncio.wait_for(arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return {"ok": True, "result": pending[:int(form.get("limit") or 100)]}
+        chat = form.get("chat_id")
+        log(method, "tg", chat=int(chat) if chat else None, cq=form.get("callback_query_id"),
+            file=form.get("file_id"))
+        if tg_latency:
+            await asyncio.sleep(tg_latency)
+        if method == "getMe":
+            res = me
+        elif method in ("sendMessage", "editMessageText"):
+            res = message(chat, text=form.get("text", ""))
+        elif method == "sendDocument":
+            d = form.get("document")
+            fid = d if isinstance(d, str) and not d.startswith("http") else f"BENCH{next(seq)}"
+            res = message(chat, document={"file_id": fid, "file_unique_id": f"u{fid}", "file_name": "doc.pdf",
+                                          "mime_type": "application/pdf"})
+        elif method == "getFile":
+            fid = form.get("file_id")
+            res = {"file_id": fid, "file_unique_id": f"u{fid}", "file_size": len(pdf),
+                   "file_path": f"documents/{fid}.pdf"}
+        elif method == "getWebhookInfo":
+            res = {"url": "", "has_custom_certificate": False, "pending_update_count": len(pending)}
+        else:   # answerCallbackQuery, deleteMessage, deleteWebhook, answerInlineQuery...
+            res = True
+        return {"ok": True, "result": res}
+
+    @app.get("/file/bot{token}/{path:path}")
+    async def download(token: str, path: str):
+        log("download", "tg", file=os.path.splitext(os.path.basename(path))[0])
+        if tg_latency:
+            await asyncio.sleep(tg_latency)
+        return Response(pdf, media_type="application/pdf")
+
+    @app.get("/files-list")
+    async def files_list(request: Request):
+        log("files-list", "api")
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse({"files": files}, headers={"ETag": etag})
+
+    @app.get("/search")
+    async def search(q: str, k: int = 6):
+        log("search", "api")
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        rnd = random.Random(q)
+        hits = []
+        for i in range(min(k, 12)):
+            name, page = rnd.choice(names), rnd.randint(1, 40)
+            hits.append({"doc_id": os.path.splitext(name)[0], "page": page, "snippet": f"… {q} …",
+                         "highlights": [[2, 2 + len(q)]], "score": 10.0 - i,
+                         "url": f"/files/{name}#page={page}", "page_url": f"/pages/{name}?p={page}"})
+        return {"query": q, "results": hits}
+
+    @app.post("/ingest")
+    async def ingest():
+        log("ingest", "api")
+        if api_latency:
+            await asyncio.sleep(api_latency)
+        return JSONResponse({"job": next(seq), "state": "queued"}, status_code=202)
+
+    return app
+
+# ---------- сценарії ----------
+def make_script(users: int, steps: int, seed: int = 1, uploads: float = 0.05, searches: float = 0.1) -> List[Dict]:
+    """Сесії користувачів з реальних меню бота: /start, далі гілки 📚 Файли і ⬆️ Промоушен
+    (nav:*, files_cat:*, promo:*, promo_nav:*, doc:*), пошук текстом і вивантаження PDF."""
+    import bot_telegram as B
+    rnd = random.Random(seed)
+    roles = dict(B.PROMO_ROLES)
+    script = []
+    for u in range(users):
+        chat = 100_000 + u
+        s = [("command", "/start")]
+        while len(s) < steps:
+            r = rnd.random()
+            if r < uploads:
+                s.append(("pdf", f"upload_{chat}_{len(s)}.pdf"))
+            elif r < uploads + searches:
+                s.append(("text", " ".join(rnd.sample(["звіт", "склад", "каса", "трансфер", "kpi", "прийом",
+                                                      "товару", "інвентаризація"], 2))))
+            elif r < 0.55:
+                cat = rnd.choice(list(B.FILE_CATEGORIES))
+                s += [("callback", "nav:files"), ("callback", f"files_cat:{cat}")]
+                titles = [t for t in B.FILE_CATEGORIES[cat] if t in B.FILES_DOCS]
+                if titles and rnd.random() < 0.5:
+                    s.append(("callback", f"doc:{B.doc_key(B.FILES_DOCS[rnd.choice(titles)])}"))
+            else:
+                role = rnd.choice(list(roles))
+                tab = rnd.choice(roles[role])
+                s += [("callback", "nav:promo"), ("callback", f"promo:{role}"),
+                      ("callback", f"promo_nav:{role}:{tab}")]
+                if rnd.random() < 0.3:
+                    s.append(("callback", "nav:home"))
+        script += [{"chat": chat, "kind": k, "data": d} for k, d in s[:steps]]
+    return script
+
+def step_kind(step: Dict) -> str:
+    if step["kind"] == "callback":
+        return step["data"].split(":", 1)[0]
+    if step["kind"] == "command":
+        return step["data"].split()[0].lstrip("/")
+    return {"text": "search", "pdf": "upload"}.get(step["kind"], step["kind"])
+
+def make_update(uid: int, step: Dict) -> Dict:
+    chat = step["chat"]
+    user = {"id": chat, "is_bot": False, "first_name": f"Store {chat}", "language_code": "uk"}
+    msg = {"message_id": uid, "date": int(time.time()), "chat": {"id": chat, "type": "private"}, "from": user}
+    if step["kind"] == "callback":
+        bot_msg = dict(msg, text="…", **{"from": {"id": int(FAKE_TOKEN.split(":")[0]), "is_bot": True,
+                                                   "first_name": "Bench"}})
+        return {"update_id": uid, "callback_query": {"id": str(uid), "from": user, "chat_instance": str(chat),
+                                                     "data": step["data"], "message": bot_msg}}
+    if step["kind"] == "pdf":
+        msg["document"] = {"file_id": f"F{uid}", "file_unique_id": f"uF{uid}", "file_name": step["data"],
+                           "mime_type": "application/pdf", "file_size": 4096}
+    else:
+        msg["text"] = step["data"]
+        if step["kind"] == "command":
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(step["data"].split()[0])}]
+    return {"update_id": uid, "message": msg}
+
+# ---------- програвання ----------
+def _stopwatch(inner):
+    """Обгортка над процесором апдейтів Application: коли апдейт почали обробляти і коли закінчили.
+    Семафор обгортки (у final process_update) має ту саму ємність, що й у справжнього процесора,
+    а далі — його do_process_update: порядок і паралелізм лишаються за ним."""
+    from telegram.ext import BaseUpdateProcessor
+
+    class Stopwatch(BaseUpdateProcessor):
+        def __init__(self):
+            super().__init__(inner.max_concurrent_updates)
+            self.waiting: Dict[int, asyncio.Future] = {}
+            self.started: Dict[int, float] = {}
+
+        def expect(self, uid: int) -> asyncio.Future:
+            fut = self.waiting[uid] = asyncio.get_running_loop().create_future()
+            return fut
+
+        async def do_process_update(self, update, coroutine):
+            uid = getattr(update, "update_id", None)
+
+            async def run():
+                self.started[uid] = time.time()
+                await coroutine
+            try:
+                await inner.do_process_update(update, run())
+            finally:
+                fut = self.waiting.pop(uid, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(time.time())
+
+        async def initialize(self):
+            await inner.initialize()
+
+        async def shutdown(self):
+            await inner.shutdown()
+
+    return Stopwatch()
+
+def _pct(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    ms = np.array(values) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 1), "p95": round(float(np.percentile(ms, 95)), 1),
+            "p99": round(float(np.percentile(ms, 99)), 1), "max": round(float(ms.max()), 1)}
+
+async def replay(script: List[Dict], base: str, think: float = 0.0, seed: int = 1) -> Dict:
+    import httpx
+    import bot_telegram as B
+    app = B.build_application()
+    watch = _stopwatch(app.update_processor)
+    app._update_processor = watch       # слот Application; обгортка лише міряє
+    await app.initialize()
+    await B.on_startup(app)
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+
+    by_chat: Dict[int, List[Dict]] = defaultdict(list)
+    for step in script:
+        by_chat[step["chat"]].append(step)
+    ids, records, push = iter(range(1, 1 << 62)), [], asyncio.Lock()
+    rnd = random.Random(seed)
+    client = httpx.AsyncClient(base_url=base, timeout=30)
+
+    async def user(steps: List[Dict]):
+        for step in steps:
+            # update_id зростають у порядку надходження, як у Telegram: інакше getUpdates підтвердить
+            # offset повз апдейт, що приїхав пізніше за наступний
+            async with push:
+                uid = next(ids)
+                fut = watch.expect(uid)
+                rec = {"id": uid, "chat": step["chat"], "kind": step_kind(step), "sent": time.time()}
+                records.append(rec)
+                await client.post("/_updates", json={"updates": [make_update(uid, step)]})
+            try:
+                rec["done"] = await asyncio.wait_for(fut, UPDATE_TIMEOUT)
+            except asyncio.TimeoutError:
+                rec["error"] = "timeout"
+                continue
+            rec["started"] = watch.started.pop(uid, rec["sent"])
+            if think:
+                await asyncio.sleep(rnd.expovariate(1 / think))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(s) for s in by_chat.values()))
+    wall = time.perf_counter() - t0
+    await asyncio.sleep(0.2)      # дописати журнал викликів, що ще в дорозі
+    calls = (await client.get("/_calls")).json()["calls"]
+    await client.aclose()
+    await app.updater.stop()
+    await app.stop()
+    await B.on_shutdown(app)
+    await app.shutdown()
+    return report(records, calls, wall)
+
+def report(records: List[Dict], calls: List[Dict], wall: float) -> Dict:
+    """Перцентилі затримок і виклики на апдейт. Виклики Bot API прив'язуються до апдейта за
+    callback_query_id або file_id, решта — за chat_id у вікні [відправка, кінець обробки]."""
+    ok = [r for r in records if "done" in r]
+    by_id = {r["id"]: r for r in ok}
+    windows = defaultdict(list)
+    for r in ok:
+        windows[r["chat"]].append(r)
+    per_update, loose = Counter(), 0
+    for c in calls:
+        if c["kind"] != "tg" or c["m"] in ("getMe", "deleteWebhook", "getWebhookInfo"):
+            continue
+        uid = None
+        if c.get("cq"):
+            uid = int(c["cq"])
+        elif c.get("file", "") and c["file"][:1] == "F" and c["file"][1:].isdigit():
+            uid = int(c["file"][1:])
+        elif c.get("chat") is not None:
+            uid = next((r["id"] for r in windows.get(c["chat"], ()) if r["sent"] <= c["t"] <= r["done"]), None)
+        if uid in by_id:
+            per_update[uid] += 1
+        else:
+            loose += 1
+
+    kinds = defaultdict(list)
+    for r in ok:
+        kinds[r["kind"]].append(r)
+    out = {
+        "updates": len(records), "users": len(windows), "errors": len(records) - len(ok),
+        "seconds": round(wall, 3), "updates_per_sec": round(len(ok) / wall, 1) if wall else 0.0,
+        "latency_ms": _pct([r["done"] - r["sent"] for r in ok]),
+        "queue_ms": _pct([r["started"] - r["sent"] for r in ok]),
+        "handler_ms": _pct([r["done"] - r["started"] for r in ok]),
+        "tg_calls_per_update": round(sum(per_update.values()) / max(len(ok), 1), 2),
+        "tg_calls_unattributed": loose,
+        "api_calls_per_update": round(sum(c["kind"] == "api" for c in calls) / max(len(ok), 1), 2),
+        "calls": dict(Counter(c["m"] for c in calls).most_common()),
+        "by_kind": {},
+    }
+    for kind, rs in sorted(kinds.items()):
+        lat = _pct([r["done"] - r["sent"] for r in rs])
+        out["by_kind"][kind] = {"n": len(rs), "p50_ms": lat["p50"], "p95_ms": lat["p95"],
+                                "tg_calls_per_update": round(sum(per_update[r["id"]] for r in rs) / len(rs), 2)}
+    return out
+
+def _start_fake(port: int, tg_latency: float, api_latency: float) -> subprocess.Popen:
+    """Заглушка в окремому процесі — її робота не ділить event loop і GIL з ботом."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "bot_bench.py"), "fake", "--port", str(port),
+                             "--tg-latency", str(tg_latency), "--api-latency", str(api_latency)])
+    import httpx
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"[bot-bench] fake API exited with code {proc.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/_calls", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("[bot-bench] fake API did not start")
+
+def run(args) -> Dict:
+    base = f"http://127.0.0.1:{args.port}"
+    # бот читає налаштування з оточення при імпорті; метрики й прогрів file_id тут лише заважають
+    os.environ.update(TELEGRAM_BOT_TOKEN=FAKE_TOKEN, TELEGRAM_API_BASE=base, API_BASE=base,
+                      BOT_METRICS_PORT="0", FILE_CACHE_CHAT_ID="0", ALLOWED_CHATS="[]")
+    if args.script:
+        with open(args.script) as f:
+            script = [json.loads(line) for line in f if line.strip()]
+    else:
+        script = make_script(args.users, args.steps, args.seed, args.uploads)
+    os.makedirs(os.path.join(args.dir, "docs"), exist_ok=True)
+    os.chdir(args.dir)              # вивантажені PDF і кеш file_id — у робочий каталог тесту
+    fake = _start_fake(args.port, args.tg_latency, args.api_latency)
+    try:
+        res = asyncio.run(replay(script, base, args.think, args.seed))
+    finally:
+        fake.terminate()
+        fake.wait()
+    res["config"] = {"tg_latency": args.tg_latency, "api_latency": args.api_latency, "think": args.think,
+                     "script": args.script or f"generated users={args.users} steps={args.steps} seed={args.seed}"}
+    return res
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load test for bot_telegram against a local Bot API stand-in")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("run", "script"):
+        p = sub.add_parser(name)
+        p.add_argument("--users", type=int, default=50)
+        p.add_argument("--steps", type=int, default=12, help="апдейтів на користувача")
+        p.add_argument("--uploads", type=float, default=0.05, help="частка кроків з вивантаженням PDF")
+        p.add_argument("--seed", type=int, default=1)
+        p.add_argument("--out", default="", help="куди записати JSON (run) або JSONL сценарію (script)")
+        if name == "run":
+            p.add_argument("--script", default="", help="JSONL сценарію замість згенерованого")
+            p.add_argument("--think", type=float, default=0.0, help="середня пауза користувача між діями, с")
+            p.add_argument("--tg-latency", type=float, default=0.03, help="затримка кожного виклику Bot API, с")
+            p.add_argument("--api-latency", type=float, default=0.01, help="затримка кожного виклику API_BASE, с")
+            p.add_argument("--port", type=int, default=FAKE_PORT)
+            p.add_argument("--dir", default=BOT_BENCH_DIR)
+    p = sub.add_parser("fake")
+    p.add_argument("--port", type=int, default=FAKE_PORT)
+    p.add_argument("--tg-latency", type=float, default=0.0)
+    p.add_argument("--api-latency", type=float, default=0.0)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "fake":
+        import uvicorn
+        uvicorn.run(fake_app(args.tg_latency, args.api_latency), host="127.0.0.1", port=args.port,
+                    log_level="warning")
+    elif args.cmd == "script":
+        lines = "".join(json.dumps(s, ensure_ascii=False) + "\n"
+                        for s in make_script(args.users, args.steps, args.seed, args.uploads))
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(lines)
+        else:
+            sys.stdout.write(lines)
+    else:
+        out = os.path.abspath(args.out) if args.out else ""
+        res = run(args)
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        if out:
+            with open(out, "w") as f:
+                json.dump(res, f, ensure_ascii=False, indent=2)
+            print(f"[bot-bench] results -> {out}")
+
+if __name__ == "__main__":
+    main()
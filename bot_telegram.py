@@ -1,32 +1,63 @@
 import os
+import html
 import json
+import hashlib
+import time
+import asyncio
 import httpx
+import docs_store
+import metrics
+from collections import OrderedDict
+from contextlib import contextmanager
 from typing import Dict, List, Tuple, Optional
+from urllib.parse import quote, unquote
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters,
 )
+from telegram.error import BadRequest, RetryAfter
 
 # ---------- ENV ----------
 API_BASE = os.getenv("API_BASE", "http://localhost:8000").rstrip("/")
 FILES_BASE = os.getenv("FILES_BASE", f"{API_BASE}/files").rstrip("/")
+PAGES_BASE = os.getenv("PAGES_BASE", f"{API_BASE}/pages").rstrip("/")
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Bot API; для тестів — локальна заглушка (напр. http://127.0.0.1:8081)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+
+# WEBHOOK_URL (публічна адреса API) задано — апдейти приходять POST-ом на server.py і обробляються
+# в процесі API (лише одному воркері: стан бота — у пам'яті); інакше бот — окремий процес з long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()[:48]
+# Викидати апдейти, що накопичились, поки бот лежав (раніше — завжди)
+BOT_DROP_PENDING = os.getenv("BOT_DROP_PENDING", "0") == "1"
 
 try:
     ALLOWED_CHATS = set(json.loads(os.getenv("ALLOWED_CHATS", "[]")))
 except Exception:
     ALLOWED_CHATS = set()
+# спільний з API токен для /ingest (див. server.py)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 try:
     ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
 except Exception:
@@ -269,16 +300,379 @@ async def guard(update: Update) -> bool:
     chat_id = update.effective_chat.id if update.effective_chat else None
     return chat_id in ALLOWED_CHATS
 
-async def list_files() -> List[Dict]:
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.get(f"{API_BASE}/files-list")
+# ---------- метрики ----------
+# Бот віддає свої числа на окремому порту (0 — вимкнено); API додає їх до свого /metrics
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))
+
+HANDLER_SECONDS = metrics.histogram("bot_handler_seconds", "Bot handler latency", ("handler",))
+HANDLER_ERRORS = metrics.counter("bot_handler_errors_total", "Bot handler exceptions", ("handler",))
+API_SECONDS = metrics.histogram("bot_api_seconds", "Bot -> API / Telegram round-trips", ("call",))
+metrics.gauge("bot_catalog_files", "Files in the cached /files-list", lambda: len(catalog.names))
+metrics.gauge("bot_catalog_age_seconds", "Seconds since the last /files-list refresh",
+              lambda: time.monotonic() - catalog.updated if catalog.loaded else None)
+
+def timed_handler(fn):
+    return metrics.timed(HANDLER_SECONDS, HANDLER_ERRORS, handler=fn.__name__)(fn)
+
+# ---------- HTTP-клієнт і каталог файлів ----------
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "60"))
+CATALOG_FIRST_LOAD_TIMEOUT = 5.0
+
+_http: Optional[httpx.AsyncClient] = None
+
+def http() -> httpx.AsyncClient:
+    """Один клієнт на процес: TCP/TLS-з'єднання до API_BASE перевикористовуються."""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120),
+        )
+    return _http
+
+async def close_http():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+class FileCatalog:
+    """Кеш /files-list у пам'яті. Хендлери читають його без мережі; оновлення — у фоні
+    з If-None-Match, а on_doc додає новий файл одразу."""
+
+    def __init__(self, ttl: float = CATALOG_TTL):
+        self.ttl = ttl
+        self.files: List[Dict] = []
+        self.names: set = set()
+        self.etag: Optional[str] = None
+        self.updated = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.updated > 0
+
+    async def refresh(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        with API_SECONDS.time(call="files_list"):
+            r = await http().get(f"{API_BASE}/files-list", headers=headers)
+        if r.status_code != 304:
+            r.raise_for_status()
+            self.files = r.json().get("files", [])
+            self.names = {f["name"] for f in self.files}
+            self.etag = r.headers.get("ETag")
+        self.updated = time.monotonic()
+
+    def refresh_soon(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._safe_refresh())
+        return self._refresh
+
+    async def _safe_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"[bot] catalog refresh failed: {e}", flush=True)
+
+    async def run(self):
+        while True:
+            await self.refresh_soon()
+            await asyncio.sleep(self.ttl)
+
+    async def available(self) -> set:
+        """Назви наявних PDF. Мережу чекаємо лише до першого завантаження каталогу."""
+        if not self.loaded:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.refresh_soon()), CATALOG_FIRST_LOAD_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        elif time.monotonic() - self.updated > self.ttl:
+            self.refresh_soon()
+        return self.names
+
+    def sha1(self, name: str) -> Optional[str]:
+        for f in self.files:
+            if f["name"] == name:
+                return f.get("sha1")
+        return None
+
+    def add(self, name: str, sha1: Optional[str] = None):
+        entry = {"name": name, "url": f"/files/{name}", "sha1": sha1}
+        self.names = self.names | {name}
+        self.files = [f for f in self.files if f["name"] != name] + [entry]
+        self.etag = None
+
+catalog = FileCatalog()
+
+async def request_ingest(name: str):
+    """Просить API проіндексувати збережений файл; якщо API недоступний — підхопить наступна збірка."""
+    try:
+        with API_SECONDS.time(call="ingest"):
+            r = await http().post(f"{API_BASE}/ingest", json={"name": name},
+                                  headers={"X-Admin-Token": ADMIN_TOKEN})
         r.raise_for_status()
-        return r.json().get("files", [])
+    except Exception as e:
+        print(f"[bot] ingest request for {name} failed: {e}", flush=True)
+
+async def list_files() -> List[Dict]:
+    await catalog.available()
+    return catalog.files
 
 def file_url(name: str, page: Optional[int] = None) -> str:
-    url = f"{FILES_BASE}/{name}"
+    url = f"{FILES_BASE}/{quote(name)}"
     return f"{url}#page={int(page)}" if page else url
 
+def page_url(name: str, pages, fmt: str = "pdf") -> str:
+    """Лише потрібні сторінки (під-PDF або PNG) — без завантаження всього документа."""
+    url = f"{PAGES_BASE}/{quote(name)}?p={pages}"
+    return url if fmt == "pdf" else f"{url}&format={fmt}"
+
+# ---------- кеш Telegram file_id ----------
+# sha1 вмісту PDF -> file_id: документ, який Telegram уже бачив, він віддає зі свого CDN,
+# не тягнучи файл з нашого інстансу. Новий вміст — новий sha1, тож старий запис просто не знаходиться.
+FILE_ID_CACHE_PATH = os.path.join("store", "tg_file_ids.json")
+# Куди бот тихо надсилає (і одразу видаляє) документи для прогріву кешу; 0 — без прогріву
+try:
+    FILE_CACHE_CHAT_ID = int(os.getenv("FILE_CACHE_CHAT_ID", str(ADMIN_CHAT_ID)))
+except Exception:
+    FILE_CACHE_CHAT_ID = 0
+FILE_ID_WARM_INTERVAL = float(os.getenv("FILE_ID_WARM_INTERVAL", "600"))
+
+class FileIdCache:
+    """JSON у store/: {"bot_id": ..., "files": {sha1: {"file_id", "name", "at"}}}.
+    file_id дійсний лише для бота, що його отримав, тож зі зміною токена кеш скидається.
+    Кілька процесів бота (старий і новий під час рестарту) перечитують файл, щойно змінився його mtime."""
+
+    def __init__(self, path: str = FILE_ID_CACHE_PATH):
+        self.path = path
+        self.bot_id: Optional[int] = None
+        self.files: Dict[str, Dict] = {}
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[warn] file_id cache unreadable: {e}", flush=True)
+            data = {}
+        self._mtime = mtime
+        if data.get("bot_id") == self.bot_id:   # файл новіший за пам'ять: його стан, разом із видаленнями
+            self.files = data.get("files", {})
+
+    def _save(self, changes: Dict[str, Optional[Dict]]):
+        """Перечитує файл і накладає лише власні зміни (None — видалення), щоб не затерти
+        записи іншого процесу й не воскресити ті, що він прибрав."""
+        self._load()
+        for k, v in changes.items():
+            if v is None:
+                self.files.pop(k, None)
+            else:
+                self.files[k] = v
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"bot_id": self.bot_id, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def get(self, sha1: Optional[str]) -> Optional[str]:
+        if not sha1:
+            return None
+        self._load()
+        e = self.files.get(sha1)
+        return e["file_id"] if e else None
+
+    def put(self, sha1: Optional[str], name: str, file_id: str):
+        if not sha1 or not file_id or self.get(sha1) == file_id:
+            return
+        self._save({sha1: {"file_id": file_id, "name": name, "at": int(time.time())}})
+
+    def drop(self, sha1: str):
+        self._load()
+        if sha1 in self.files:
+            self._save({sha1: None})
+
+    def prune(self, live: set):
+        """Прибирає записи вмісту, якого вже немає в каталозі (файл замінено чи видалено)."""
+        self._load()
+        stale = [k for k in self.files if k not in live]
+        if stale:
+            self._save(dict.fromkeys(stale))
+
+file_ids = FileIdCache()
+FILE_ID_HITS = metrics.counter("bot_file_id_total", "Documents sent by cached file_id vs uploaded", ("source",))
+metrics.gauge("bot_file_id_cached", "Documents with a cached Telegram file_id", lambda: len(file_ids.files))
+
+def doc_key(name: str) -> str:
+    """Коротка стабільна мітка файлу для callback_data (ліміт Telegram — 64 байти)."""
+    return hashlib.sha1(name.encode()).hexdigest()[:12]
+
+DOC_TITLES: Dict[str, str] = {v: k for k, v in {**PROMO_DOCS, **FILES_DOCS}.items()}
+
+def doc_by_key(key: str) -> Optional[str]:
+    for name in set(DOC_TITLES) | catalog.names:
+        if doc_key(name) == key:
+            return name
+    return None
+
+async def send_pdf(bot, chat_id: int, name: str, caption: Optional[str] = None, **kw):
+    """Надсилає PDF за file_id з кешу; якщо його немає — вивантажує (з docs/ або за URL) і запам'ятовує."""
+    sha1 = catalog.sha1(name)
+    fid = file_ids.get(sha1)
+    if fid:
+        try:
+            with API_SECONDS.time(call="tg_send_cached"):
+                msg = await bot.send_document(chat_id, fid, caption=caption, **kw)
+            FILE_ID_HITS.inc(source="cache")
+            return msg
+        except BadRequest as e:   # file_id став недійсним — вивантажуємо заново
+            print(f"[warn] cached file_id for {name} rejected: {e}", flush=True)
+            file_ids.drop(sha1)
+    path = os.path.join(docs_store.DOCS_DIR, name)
+    with API_SECONDS.time(call="tg_send_upload"):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                msg = await bot.send_document(chat_id, f, filename=name, caption=caption, **kw)
+        else:
+            msg = await bot.send_document(chat_id, file_url(name), filename=name, caption=caption, **kw)
+    FILE_ID_HITS.inc(source="upload")
+    if msg.document:
+        file_ids.put(sha1, name, msg.document.file_id)
+    return msg
+
+@contextmanager
+def _warm_lock():
+    """Прогріває лише один процес: решта отримають file_id з файлу кешу."""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(FILE_ID_CACHE_PATH) or ".", exist_ok=True)
+    with open(f"{FILE_ID_CACHE_PATH}.lock", "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+async def warm_file_ids(bot):
+    """Фоном: кожен документ із FILES_DOCS/PROMO_DOCS без file_id надсилаємо у FILE_CACHE_CHAT_ID
+    й одразу видаляємо повідомлення — file_id лишається дійсним."""
+    await catalog.available()
+    with _warm_lock() as owner:
+        if not owner:
+            return
+        file_ids.prune({f["sha1"] for f in catalog.files if f.get("sha1")})
+        for name in sorted(set(FILES_DOCS.values()) | set(PROMO_DOCS.values())):
+            sha1 = catalog.sha1(name)
+            if not sha1 or file_ids.get(sha1):
+                continue
+            try:
+                msg = await send_pdf(bot, FILE_CACHE_CHAT_ID, name, disable_notification=True)
+                await bot.delete_message(FILE_CACHE_CHAT_ID, msg.message_id)
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                print(f"[warn] file_id warm-up for {name}: {e}", flush=True)
+            await asyncio.sleep(1.0)   # не впиратись у ліміти Bot API
+
+async def file_id_warmer(bot):
+    while True:
+        try:
+            await warm_file_ids(bot)
+        except Exception as e:
+            print(f"[warn] file_id warm-up failed: {e}", flush=True)
+        await asyncio.sleep(FILE_ID_WARM_INTERVAL)
+
+# ---------- пошук ----------
+# BM25 рахує API у своєму пулі потоків; бот лише робить запит і гортає вже отримані результати
+SEARCH_FETCH = 30             # хітів на запит; гортання йде по них без повторного пошуку
+SEARCH_PAGE_SIZE = 5
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_TTL = 600
+SEARCHES_PER_USER = 5         # скільки останніх видач користувача можна гортати
+INLINE_PAGE_SIZE = 10
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.35"))
+
+SEARCHES = metrics.counter("bot_search_total", "Bot searches by source and outcome", ("source", "result"))
+
+_search_cache: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+_search_inflight: Dict[str, asyncio.Future] = {}
+_inline_latest: Dict[int, object] = {}
+
+def _norm_query(q: str) -> str:
+    return " ".join(q.lower().split())
+
+async def _fetch_hits(key: str) -> List[Dict]:
+    with API_SECONDS.time(call="search"):
+        r = await http().get(f"{API_BASE}/search", params={"q": key, "k": SEARCH_FETCH})
+    r.raise_for_status()
+    hits = r.json().get("results", [])
+    _search_cache[key] = (time.monotonic(), hits)
+    while len(_search_cache) > SEARCH_CACHE_SIZE:
+        _search_cache.popitem(last=False)
+    return hits
+
+async def search_hits(q: str) -> List[Dict]:
+    """Хіти /search. Свіжі — з кешу; однаковий запит, що вже в дорозі, чекає той самий виклик."""
+    key = _norm_query(q)
+    cached = _search_cache.get(key)
+    if cached and time.monotonic() - cached[0] < SEARCH_CACHE_TTL:
+        _search_cache.move_to_end(key)
+        return cached[1]
+    fut = _search_inflight.get(key)
+    if fut is None:
+        fut = _search_inflight[key] = asyncio.ensure_future(_fetch_hits(key))
+        fut.add_done_callback(lambda _: _search_inflight.pop(key, None))
+    return await asyncio.shield(fut)
+
+def hit_name(h: Dict) -> str:
+    return unquote(h["url"].split("/files/", 1)[1].split("#", 1)[0])
+
+def highlight(snippet: str, spans) -> str:
+    """HTML сніпета з <b> навколо збігів (зсуви — від API)."""
+    out, pos = [], 0
+    for a, b in spans:
+        if a < pos:
+            continue
+        out += [html.escape(snippet[pos:a]), "<b>", html.escape(snippet[a:b]), "</b>"]
+        pos = b
+    out.append(html.escape(snippet[pos:]))
+    return "".join(out)
+
+def render_hit(h: Dict, n: Optional[int] = None) -> str:
+    name = hit_name(h)
+    title = html.escape(DOC_TITLES.get(name, h["doc_id"]))
+    head = f"{n}. <b>{title}</b>" if n else f"<b>{title}</b>"
+    links = (f'<a href="{html.escape(page_url(name, h["page"]))}">📄 сторінка</a> · '
+             f'<a href="{html.escape(file_url(name, h["page"]))}">весь документ</a>')
+    return f"{head} — стор. {h['page']}\n{highlight(h['snippet'], h['highlights'])}\n{links}"
+
+def search_page(state: Dict, page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    hits, size = state["hits"], SEARCH_PAGE_SIZE
+    pages = max(1, -(-len(hits) // size))
+    page = min(max(page, 0), pages - 1)
+    head = f"🔎 «{html.escape(state['q'])}» — результатів: {len(hits)}"
+    if pages > 1:
+        head += f", стор. {page + 1}/{pages}"
+    body = "\n\n".join(render_hit(h, page * size + i + 1) for i, h in enumerate(hits[page * size:(page + 1) * size]))
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"sr:{state['id']}:{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"sr:{state['id']}:{page + 1}"))
+    return f"{head}\n\n{body}", InlineKeyboardMarkup([nav]) if nav else None
+
 # ---------- HANDLERS ----------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await guard(update):
@@ -287,7 +681,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👋 Ласкаво просимо до *LC Waikiki Guide Bot*.\n\n"
         "• **Файли** — категорії: *Модулі*, *Довідники*, *Welcome*\n"
         "• **Промоушен** — програма для 3 позицій (з міні-гайдами)\n\n"
-        "Надішліть PDF як документ — я додам його до бібліотеки."
+        "Надішліть PDF як документ — я додам його до бібліотеки.\n"
+        "Напишіть питання (або /search ...) — знайду сторінку в документах."
     )
     await update.message.reply_text(text, parse_mode="Markdown", reply_markup=inline_home_kb())
 
@@ -309,12 +704,8 @@ async def files_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     _, cat = q.data.split(":", 1)
 
-    # список файлів на сервері
-    try:
-        files = await list_files()
-        available = {f["name"] for f in files}
-    except Exception:
-        available = set()
+    # список файлів на сервері (з каталогу в пам'яті)
+    available = await catalog.available()
 
     titles = FILE_CATEGORIES.get(cat, [])
     buttons = []
@@ -326,7 +717,7 @@ async def files_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
             missing.append(f"⚠️ Немає мапінгу: {title}")
             continue
         if filename in available:
-            buttons.append([InlineKeyboardButton(title, url=file_url(filename))])
+            buttons.append([InlineKeyboardButton(title, callback_data=f"doc:{doc_key(filename)}")])
         else:
             missing.append(f"— {title} (файл ще не завантажено)")
 
@@ -389,11 +780,7 @@ async def on_promo_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text(text=header)
 
     # 2) КНОПКИ З ДОКУМЕНТАМИ (лише наявні)
-    try:
-        files = await list_files()
-        available = {f["name"] for f in files}
-    except Exception:
-        available = set()
+    available = await catalog.available()
 
     items = PROMO_MAP.get(role, {}).get(tab, [])
     anchors = PAGE_ANCHORS.get(role, {}).get(tab, {})
@@ -404,8 +791,11 @@ async def on_promo_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not filename or filename not in available:
             continue
         page = anchors.get(title)
-        url = file_url(filename, page)
-        buttons.append([InlineKeyboardButton(title, url=url)])
+        data = f"doc:{doc_key(filename)}:{page}" if page else f"doc:{doc_key(filename)}"
+        row = [InlineKeyboardButton(title, callback_data=data)]
+        if page:
+            row.append(InlineKeyboardButton(f"📄 стор. {page}", url=page_url(filename, page)))
+        buttons.append(row)
 
     if buttons:
         buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=f"promo:{role}"),
@@ -425,10 +815,126 @@ async def on_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     doc = update.message.document
     if not doc or not doc.file_name.lower().endswith(".pdf"):
         return await update.message.reply_text("Потрібен PDF-документ (надішліть як *Документ*, не як фото).")
-    file = await doc.get_file()
-    path = os.path.join("docs", doc.file_name)
-    await file.download_to_drive(path)
-    await update.message.reply_text("✅ PDF збережено. Перевірте у 📚 Файли або в розділах Промоушен.")
+    name = docs_store.safe_name(doc.file_name)
+    if not name:
+        return await update.message.reply_text("Некоректна назва файлу.")
+    if doc.file_size and doc.file_size > docs_store.MAX_UPLOAD_BYTES:
+        return await update.message.reply_text("Файл завеликий для бібліотеки.")
+    # завантаження — у фоновій черзі: чат і слот обробки апдейтів не чекають на Telegram
+    if not jobs.submit("upload", save_upload, update.message, name):
+        await update.message.reply_text("⏳ Зараз забагато завантажень — надішліть PDF ще раз за хвилину.")
+
+async def save_upload(message, name: str):
+    doc = message.document
+    try:
+        file = await doc.get_file()
+        # спершу в тимчасовий файл, потім атомарний rename — /files ніколи не віддасть недописаний PDF
+        tmp = docs_store.temp_path(name)
+        try:
+            with API_SECONDS.time(call="tg_download"):
+                await file.download_to_drive(tmp)
+            path = await asyncio.to_thread(docs_store.commit_file, tmp, name)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    except Exception:
+        await message.reply_text("❌ Не вдалося завантажити PDF — спробуйте надіслати ще раз.")
+        raise
+    sha1 = await asyncio.to_thread(docs_store.file_sha1, path)
+    catalog.add(name, sha1)
+    file_ids.put(sha1, name, doc.file_id)   # цей самий вміст далі надсилаємо без вивантаження
+    await request_ingest(name)
+    await message.reply_text("✅ PDF збережено. Перевірте у 📚 Файли або в розділах Промоушен.")
+
+# --- Надсилання документа (за file_id, якщо Telegram його вже бачив) ---
+async def on_doc_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await guard(update): return
+    q = update.callback_query
+    _, key, *rest = q.data.split(":")
+    name = doc_by_key(key)
+    if not name or name not in await catalog.available():
+        return await q.answer("Файл недоступний.", show_alert=True)
+    await q.answer("Надсилаю…")
+    caption = DOC_TITLES.get(name, name)
+    if rest and rest[0].isdigit():
+        caption += f"\n📖 Див. стор. {rest[0]}"
+    await send_pdf(context.bot, q.message.chat_id, name, caption=caption)
+
+# --- Пошук по документах ---
+async def run_search(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
+    if len(query) < 2:
+        return await update.message.reply_text("Напишіть, що шукати: /search як робити трансфер")
+    try:
+        hits = await search_hits(query)
+    except Exception as e:
+        print(f"[bot] search failed: {e}", flush=True)
+        SEARCHES.inc(source="chat", result="error")
+        return await update.message.reply_text("⚠️ Пошук тимчасово недоступний, спробуйте за хвилину.")
+    SEARCHES.inc(source="chat", result="ok" if hits else "empty")
+    if not hits:
+        return await update.message.reply_text(f"Нічого не знайдено за запитом «{query}».")
+    searches = context.user_data.setdefault("searches", OrderedDict())
+    sid = context.user_data["search_seq"] = context.user_data.get("search_seq", 0) + 1
+    searches[sid] = state = {"id": sid, "q": query, "hits": hits}
+    while len(searches) > SEARCHES_PER_USER:
+        searches.popitem(last=False)
+    text, kb = search_page(state, 0)
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await guard(update): return
+    await run_search(update, context, " ".join(context.args or []).strip())
+
+async def on_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Гортання видачі: сторінка береться зі збережених хітів користувача, пошук не повторюється."""
+    if not await guard(update): return
+    q = update.callback_query
+    _, sid, page = q.data.split(":")
+    state = context.user_data.get("searches", {}).get(int(sid))
+    if state is None:
+        return await q.answer("Результати застаріли — повторіть пошук.", show_alert=True)
+    await q.answer()
+    text, kb = search_page(state, int(page))
+    await q.edit_message_text(text, parse_mode="HTML", reply_markup=kb, disable_web_page_preview=True)
+
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@бот запит у будь-якому чаті. Telegram шле запит на кожне натискання клавіші: чекаємо
+    INLINE_DEBOUNCE і відповідаємо лише на останній; наступні сторінки (offset) — з кешу пошуку."""
+    iq = update.inline_query
+    if ALLOWED_CHATS and iq.from_user.id not in ALLOWED_CHATS:
+        return await iq.answer([], cache_time=300, is_personal=True)
+    query, uid = iq.query.strip(), iq.from_user.id
+    if len(query) < 2:
+        return await iq.answer([], cache_time=5)
+    offset = int(iq.offset) if iq.offset.isdigit() else 0
+    if not offset:
+        token = _inline_latest[uid] = object()
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if _inline_latest.get(uid) is not token:
+            SEARCHES.inc(source="inline", result="debounced")
+            return
+        del _inline_latest[uid]
+    try:
+        hits = await search_hits(query)
+    except Exception as e:
+        print(f"[bot] inline search failed: {e}", flush=True)
+        SEARCHES.inc(source="inline", result="error")
+        return
+    SEARCHES.inc(source="inline", result="ok" if hits else "empty")
+    chunk = hits[offset:offset + INLINE_PAGE_SIZE]
+    results = [
+        InlineQueryResultArticle(
+            id=str(offset + i),
+            title=f"{DOC_TITLES.get(hit_name(h), h['doc_id'])} — стор. {h['page']}",
+            description=h["snippet"][:200],
+            url=page_url(hit_name(h), h["page"]),
+            input_message_content=InputTextMessageContent(render_hit(h), parse_mode="HTML",
+                                                          disable_web_page_preview=True),
+        )
+        for i, h in enumerate(chunk)
+    ]
+    more = offset + len(chunk) < len(hits)
+    await iq.answer(results, cache_time=60, next_offset=str(offset + len(chunk)) if more else "")
 
 # --- Text buttons ---
 async def on_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -437,6 +943,9 @@ async def on_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await files_home(update, context)
     if text == "⬆️ Промоушен":
         return await promo_menu(update, context)
+    # будь-який інший текст — пошуковий запит
+    if not await guard(update): return
+    await run_search(update, context, text)
 
 # --- Inline nav router ---
 async def on_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -460,37 +969,197 @@ async def on_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             await q.message.reply_text(caption, parse_mode="Markdown", reply_markup=inline_home_kb())
 
+# ---------- паралельна обробка апдейтів ----------
+# Скільки апдейтів обробляється одночасно (різні чати); 1 — строго по одному, як раніше
+BOT_CONCURRENCY = int(os.getenv("BOT_CONCURRENCY", "16"))
+BOT_JOB_WORKERS = int(os.getenv("BOT_JOB_WORKERS", "2"))      # паралельних завантажень PDF
+BOT_JOB_QUEUE = int(os.getenv("BOT_JOB_QUEUE", "20"))         # понад це — «спробуйте пізніше»
+BOT_JOB_DRAIN = float(os.getenv("BOT_JOB_DRAIN", "30"))       # с на дозавантаження при зупинці
+
+UPDATE_WAIT_SECONDS = metrics.histogram("bot_update_chat_wait_seconds",
+                                        "Time an update waits for earlier updates of the same chat")
+JOB_SECONDS = metrics.histogram("bot_job_seconds", "Background job duration", ("kind",))
+JOBS_TOTAL = metrics.counter("bot_jobs_total", "Background jobs by outcome", ("kind", "result"))
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Апдейти різних чатів — паралельно, не більше limit одночасно; одного чату — строго в порядку
+    надходження (послідовні edit_message_text не обганяють одне одного). Апдейт, що чекає на
+    попередні свого чату, слота ліміту не займає. Порядок — у межах процесу, тому webhook
+    можливий лише з одним воркером API (див. server.py).
+
+    Семафор BaseUpdateProcessor.process_update (метод final) тут формальний, з недосяжною ємністю:
+    його acquire не віддає керування, тож черга чату складається в порядку, в якому Application
+    створює задачі. Справжній ліміт — власний семафор, що береться вже після черги чату."""
+
+    def __init__(self, limit: int):
+        super().__init__(2**31 - 1)
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._tails: Dict[int, asyncio.Future] = {}     # чат -> «завершився останній його апдейт»
+
+    async def do_process_update(self, update, coroutine):
+        chat = (update.effective_chat or update.effective_user) if isinstance(update, Update) else None
+        if chat is None:
+            async with self._slots:
+                return await coroutine
+        prev = self._tails.get(chat.id)
+        done = self._tails[chat.id] = asyncio.get_running_loop().create_future()
+        try:
+            if prev is not None:
+                t0 = time.perf_counter()
+                await asyncio.shield(prev)     # скасування цього апдейта не чіпає попередній
+                UPDATE_WAIT_SECONDS.observe(time.perf_counter() - t0)
+            async with self._slots:
+                await coroutine
+        finally:
+            done.set_result(None)
+            if self._tails.get(chat.id) is done:
+                del self._tails[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+class Jobs:
+    """Довга робота (завантаження PDF з Telegram) — окрема обмежена черга з кількома воркерами:
+    вона не тримає ні чергу чату, ні слот обробки апдейтів. Переповнена черга відмовляє одразу."""
+
+    def __init__(self, workers: int = BOT_JOB_WORKERS, size: int = BOT_JOB_QUEUE):
+        self.workers, self.size = workers, size
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self.queue = asyncio.Queue(self.size)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = BOT_JOB_DRAIN):
+        if self.queue is not None and self.tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"[warn] {self.queue.qsize()} background jobs dropped on shutdown", flush=True)
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, kind: str, fn, *args) -> bool:
+        try:
+            self.queue.put_nowait((kind, fn, args))
+        except asyncio.QueueFull:
+            JOBS_TOTAL.inc(kind=kind, result="rejected")
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            kind, fn, args = await self.queue.get()
+            try:
+                with JOB_SECONDS.time(kind=kind):
+                    await fn(*args)
+                JOBS_TOTAL.inc(kind=kind, result="done")
+            except Exception as e:
+                JOBS_TOTAL.inc(kind=kind, result="failed")
+                print(f"[warn] {kind} job failed: {e}", flush=True)
+            finally:
+                self.queue.task_done()
+
+jobs = Jobs()
+metrics.gauge("bot_jobs_queued", "Background jobs waiting for a worker",
+              lambda: jobs.queue.qsize() if jobs.queue is not None else None)
+
 # ---------- BOOT ----------
-def main():
-    print("[bot] starting application...", flush=True)
-    if not BOT_TOKEN:
-        print("[bot] ERROR: TELEGRAM_BOT_TOKEN is empty", flush=True)
-        raise SystemExit(1)
+async def on_startup(app):
+    jobs.start()
+    app.bot_data["catalog_task"] = asyncio.create_task(catalog.run())
+    file_ids.bot_id = app.bot.id
+    if FILE_CACHE_CHAT_ID:
+        app.bot_data["file_id_task"] = asyncio.create_task(file_id_warmer(app.bot))
+    # у режимі webhook бот живе в процесі API і його метрики вже в спільному /metrics
+    if BOT_METRICS_PORT and app.updater is not None:
+        try:
+            app.bot_data["metrics_server"] = metrics.start_http_server(BOT_METRICS_PORT)
+        except OSError as e:
+            print(f"[warn] bot metrics port {BOT_METRICS_PORT}: {e}", flush=True)
+
+async def on_shutdown(app):
+    await jobs.stop()
+    for key in ("catalog_task", "file_id_task"):
+        task = app.bot_data.pop(key, None)
+        if task:
+            task.cancel()
+    srv = app.bot_data.pop("metrics_server", None)
+    if srv:
+        srv.shutdown()
+    await close_http()
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_application(webhook: bool = False):
+    """Application з усіма хендлерами. webhook=True — без Updater: апдейти подає server.py."""
+    # on_shutdown — одразу після stop(), поки бот ще може відповісти на дозавантажені PDF
+    builder = (ApplicationBuilder().token(BOT_TOKEN)
+               .base_url(f"{TELEGRAM_API_BASE}/bot").base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+               .post_init(on_startup).post_stop(on_shutdown))
+    if BOT_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(ChatOrderedProcessor(BOT_CONCURRENCY))
+    if webhook:
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Команди
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("files", lambda u, c: files_home(u, c)))
-    app.add_handler(CommandHandler("promo", lambda u, c: promo_menu(u, c)))
+    app.add_handler(CommandHandler("start", timed_handler(start)))
+    app.add_handler(CommandHandler("files", timed_handler(files_home)))
+    app.add_handler(CommandHandler("promo", timed_handler(promo_menu)))
+    app.add_handler(CommandHandler(["search", "s"], timed_handler(search_cmd)))
 
     # Inline колбеки
-    app.add_handler(CallbackQueryHandler(on_nav, pattern=r"^nav:"))
-    app.add_handler(CallbackQueryHandler(files_category, pattern=r"^files_cat:"))
-    app.add_handler(CallbackQueryHandler(on_promo_role, pattern=r"^promo:"))
-    app.add_handler(CallbackQueryHandler(on_promo_nav, pattern=r"^promo_nav:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(on_nav), pattern=r"^nav:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(files_category), pattern=r"^files_cat:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(on_promo_role), pattern=r"^promo:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(on_promo_nav), pattern=r"^promo_nav:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(on_doc_button), pattern=r"^doc:"))
+    app.add_handler(CallbackQueryHandler(timed_handler(on_search_page), pattern=r"^sr:"))
+    # block=False: пауза дебаунсу не затримує обробку інших апдейтів
+    app.add_handler(InlineQueryHandler(timed_handler(on_inline_query), block=False))
 
     # Текстові кнопки + прийом PDF
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_buttons))
-    app.add_handler(MessageHandler(filters.Document.PDF, on_doc))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler(on_text_buttons)))
+    app.add_handler(MessageHandler(filters.Document.PDF, timed_handler(on_doc)))
+    return app
 
-    print("[bot] polling...", flush=True)
-    app.run_polling(drop_pending_updates=True, close_loop=False)
+# ---------- webhook (у процесі server.py) ----------
+async def start_webhook(app):
+    """Запуск без Updater і реєстрація webhook у (єдиному) воркері API."""
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+    # щоразу, навіть з тим самим URL: getWebhookInfo не показує secret_token, а зі старим
+    # секретом кожен апдейт отримав би 403
+    url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+    await app.bot.set_webhook(url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    print(f"[bot] webhook set to {url}", flush=True)
 
-if __name__ == "__main__":
-    main()
+async def stop_webhook(app):
+    # webhook не знімаємо: апдейти, що прийдуть під час рестарту, Telegram доставить повторно
+    await app.stop()
+    await on_shutdown(app)
+    await app.shutdown()
+
+async def feed_update(app, data: Dict):
+    await app.update_queue.put(Update.de_json(data, app.bot))
 
-    app.run_polling(drop_pending_updates=True, close_loop=False)
+def main():
+    print("[bot] starting application...", flush=True)
+    if not BOT_TOKEN:
+        print("[bot] ERROR: TELEGRAM_BOT_TOKEN is empty", flush=True)
+        raise SystemExit(1)
+
+    app = build_application()
+    # run_polling сам знімає webhook, тож перемикання назад на polling — лише прибрати WEBHOOK_URL
+    print("[bot] polling...", flush=True)
+    app.run_polling(drop_pending_updates=BOT_DROP_PENDING, allowed_updates=Update.ALL_TYPES, close_loop=False)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,179 @@
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+DOCS_DIR = "docs"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+CHUNK = 1024 * 1024
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ---------- атомарний запис ----------
+class UploadTooLarge(ValueError):
+    pass
+
+def safe_name(name: Optional[str]) -> Optional[str]:
+    """Лише ім'я файлу без шляху; None, якщо з нього нічого не лишилось."""
+    name = os.path.basename((name or "").replace("\\", "/")).strip()
+    return name if name and not name.startswith(".") else None
+
+def temp_path(name: str, root: str = DOCS_DIR) -> str:
+    """Тимчасовий файл у тому ж каталозі (для атомарного rename); у /files-list не потрапляє."""
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=root)
+    os.close(fd)
+    return tmp
+
+def _fsync_dir(root: str):
+    try:
+        fd = os.open(root, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def commit_file(tmp: str, name: str, root: str = DOCS_DIR) -> str:
+    """fsync готового тимчасового файлу й атомарна заміна docs/<name>:
+    читач бачить або старий файл, або новий, але ніколи — недописаний."""
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    path = os.path.join(root, name)
+    os.replace(tmp, path)
+    _fsync_dir(root)
+    catalog.invalidate()
+    return path
+
+def save_stream(src, name: str, max_bytes: int = MAX_UPLOAD_BYTES, root: str = DOCS_DIR) -> str:
+    """Копіює файловий об'єкт у docs/<name> шматками по CHUNK, не тримаючи його в пам'яті."""
+    tmp = temp_path(name, root)
+    try:
+        total = 0
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = src.read(CHUNK)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise UploadTooLarge(f"file is larger than {max_bytes // (1024 * 1024)} MB")
+                f.write(chunk)
+        return commit_file(tmp, name, root)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+class DocsCatalog:
+    """Знімок docs/ у пам'яті: розмір, mtime і sha1 кожного PDF плюс готове тіло /files-list
+    (звичайне й gzip) з ETag. Перебудовується, лише коли змінився mtime каталогу."""
+
+    def __init__(self, root: str = DOCS_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._key = None
+        self._hashes: Dict[Tuple[str, int, int], str] = {}   # (name, mtime_ns, size) -> sha1
+        self.entries: Dict[str, Dict] = {}
+        self.body = b""
+        self.body_gz = b""
+        self.etag = ""
+
+    def invalidate(self):
+        with self._lock:
+            self._key = None
+
+    def _dir_key(self):
+        try:
+            return os.stat(self.root).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> "DocsCatalog":
+        key = self._dir_key()
+        if key != self._key:
+            with self._lock:
+                if key != self._key:
+                    self._rebuild(key)
+        return self
+
+    def _rebuild(self, key):
+        entries, hashes = {}, {}
+        if key is not None:
+            for e in sorted(os.scandir(self.root), key=lambda e: e.name):
+                if not e.name.lower().endswith(".pdf") or not e.is_file():
+                    continue
+                st = e.stat()
+                hk = (e.name, st.st_mtime_ns, st.st_size)
+                sha1 = self._hashes.get(hk) or file_sha1(e.path)
+                hashes[hk] = sha1
+                entries[e.name] = {"name": e.name, "url": f"/files/{e.name}", "size": st.st_size,
+                                   "mtime": st.st_mtime, "mtime_ns": st.st_mtime_ns, "sha1": sha1}
+        files = [{k: v for k, v in m.items() if k != "mtime_ns"} for m in entries.values()]
+        self.body = json.dumps({"files": files}, ensure_ascii=False).encode()
+        self.body_gz = gzip.compress(self.body, 6)
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self.entries, self._hashes, self._key = entries, hashes, key
+
+    def entry(self, name: str) -> Optional[Dict]:
+        """Запис для одного PDF; перезапис файлу на місці (без зміни mtime каталогу) теж помічається."""
+        if name != os.path.basename(name) or name.startswith("."):
+            return None
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return None
+        m = self.snapshot().entries.get(name)
+        if m is None or m["mtime_ns"] != st.st_mtime_ns or m["size"] != st.st_size:
+            self.invalidate()
+            m = self.snapshot().entries.get(name)
+        return m
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in [t.strip().removeprefix("W/") for t in header.split(",")]
+
+def parse_range(header: str, size: int):
+    """Один діапазон "bytes=a-b" -> (start, end). False — ігнорувати заголовок (віддати весь файл),
+    None — діапазон поза файлом (416)."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return False
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:                  # bytes=-N: останні N байтів
+            n = int(last)
+            if n <= 0:
+                return None
+            return max(size - n, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return False
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+def iter_file(path: str, start: int, end: int, chunk: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start + 1
+        while left > 0:
+            data = f.read(min(chunk, left))
+            if not data:
+                break
+            left -= len(data)
+            yield data
+
+catalog = DocsCatalog()
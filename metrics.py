@@ -0,0 +1,244 @@
+"""Легкий реєстр метрик у процесі: лічильники, гістограми латентності й gauge-колбеки
+у текстовому форматі Prometheus — без prometheus_client."""
+import time
+import asyncio
+import threading
+import functools
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) or abs(v) >= 1e15 else str(int(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}   # ключ -> [лічильники кошиків..., сума, кількість]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    row[i] += 1
+                    break
+            row[-2] += value
+            row[-1] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, row in items:
+            acc = 0
+            for b, c in zip(self.buckets, row):
+                acc += c
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {acc}")
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {row[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_num(row[-2])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {row[-1]}")
+        return out
+
+class Gauge(_Metric):
+    """Значення читається колбеком у момент віддачі /metrics: число або {(мітки...): число}."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, fn: Callable, labels=()):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            v = self.fn()
+        except Exception as e:
+            print(f"[warn] gauge {self.name}: {e}")
+            return []
+        if isinstance(v, dict):
+            return [f"{self.name}{_fmt_labels(self.labels, tuple(k) if isinstance(k, tuple) else (k,))} {_num(x)}"
+                    for k, x in sorted(v.items())]
+        return [] if v is None else [f"{self.name} {_num(v)}"]
+
+class _Timer:
+    def __init__(self, hist: Histogram, labels: Dict):
+        self.hist, self.labels = hist, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, **self.labels)
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, m: _Metric) -> _Metric:
+        with self._lock:
+            old = self._metrics.get(m.name)
+            if old is not None:      # повторний імпорт модуля — той самий об'єкт
+                if type(old) is not type(m):
+                    raise ValueError(f"metric {m.name} already registered as {old.kind}")
+                if isinstance(old, Gauge):
+                    old.fn = m.fn
+                return old
+            self._metrics[m.name] = m
+            return m
+
+    def counter(self, name: str, doc: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, doc, labels))
+
+    def histogram(self, name: str, doc: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labels, buckets))
+
+    def gauge(self, name: str, doc: str, fn: Callable, labels: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, doc, fn, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+counter, histogram, gauge, render = REGISTRY.counter, REGISTRY.histogram, REGISTRY.gauge, REGISTRY.render
+
+def timed(hist: Histogram, errors: Optional[Counter] = None, **labels):
+    """Декоратор: час виклику (і винятки, якщо передано errors) для звичайних і async функцій."""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def inner(*a, **kw):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*a, **kw)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    hist.observe(time.perf_counter() - t0, **labels)
+        else:
+            @functools.wraps(fn)
+            def inner(*a, **kw):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*a, **kw)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    hist.observe(time.perf_counter() - t0, **labels)
+        return inner
+    return wrap
+
+# ---------- HTTP ----------
+class ASGIMetrics:
+    """ASGI-мідлвар: кількість і латентність запитів за шаблоном маршруту (/files/{name}, а не ім'я файлу)."""
+
+    def __init__(self, app, prefix: str = "http"):
+        self.app = app
+        self.requests = counter(f"{prefix}_requests_total", "HTTP requests", ("method", "route", "status"))
+        self.seconds = histogram(f"{prefix}_request_duration_seconds", "HTTP request latency, until the body is sent",
+                                 ("method", "route"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0, status = time.perf_counter(), [500]
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            await send(msg)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.seconds.observe(time.perf_counter() - t0, method=scope["method"], route=route)
+            self.requests.inc(method=scope["method"], route=route, status=status[0])
+
+def start_http_server(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """GET /metrics на окремому порту у фоновому потоці — для процесів без власного HTTP (бот)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics-http", daemon=True).start()
+    return srv
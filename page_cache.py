@@ -0,0 +1,142 @@
+"""Окремі сторінки PDF: під-PDF з діапазону сторінок або PNG однієї сторінки.
+Готові файли лежать у store/pages/ під ключем (sha1 вмісту, сторінки, формат), тож зміна
+документа дає новий ключ; кеш обмежений за розміром і витісняє найдавніше використані."""
+import os
+import time
+import threading
+from typing import Optional, Tuple
+
+import docs_store
+import metrics
+
+PAGE_CACHE_DIR = "store/pages"
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_MB", "200")) * 1024 * 1024
+PAGE_RANGE_MAX = 20                 # сторінок в одному під-PDF
+# файл, до якого зверталися за останні стільки секунд, не витісняється: інший процес міг
+# щойно отримати його як влучання і ще віддає
+PAGE_CACHE_GRACE = float(os.getenv("PAGE_CACHE_GRACE", "60"))
+DPI_DEFAULT, DPI_MIN, DPI_MAX = 110, 36, 300
+
+PAGE_RENDER_SECONDS = metrics.histogram("page_render_seconds", "Sub-PDF / PNG generation", ("format",))
+PAGE_CACHE_TOTAL = metrics.counter("page_cache_total", "Page cache lookups", ("result",))
+
+_lock = threading.Lock()
+_used = None        # байтів у кеші; None — ще не рахували
+
+class PageError(ValueError):
+    pass
+
+class DocumentError(PageError):
+    """PDF не відкривається або не рендериться (битий, обрізаний)."""
+
+def parse_pages(spec: str, page_count: Optional[int] = None) -> Tuple[int, int]:
+    """"5" або "3-7" (1-based, включно) -> (first, last); з page_count — ще й у межах документа."""
+    first, _, last = (spec or "").strip().partition("-")
+    try:
+        a = int(first)
+        b = int(last) if last else a
+    except ValueError:
+        raise PageError("pages must be N or N-M")
+    if a < 1 or b < a:
+        raise PageError("pages must be N or N-M with 1 <= N <= M")
+    if page_count is not None and b > page_count:
+        raise PageError(f"pages out of range 1..{page_count}")
+    if b - a + 1 > PAGE_RANGE_MAX:
+        raise PageError(f"at most {PAGE_RANGE_MAX} pages per request")
+    return a, b
+
+def cache_key(sha1: str, first: int, last: int, fmt: str, dpi: Optional[int] = None) -> str:
+    if fmt == "png":
+        return f"{sha1}_{first}_{dpi}.png"
+    return f"{sha1}_{first}-{last}.pdf"
+
+def _render(doc, dst: str, first: int, last: int, fmt: str, dpi: int):
+    """З уже відкритого документа (fitz.Document) — у dst через тимчасовий файл."""
+    import fitz
+    tmp = f"{dst}.tmp{os.getpid()}.{threading.get_ident()}"
+    try:
+        with PAGE_RENDER_SECONDS.time(format=fmt):
+            if fmt == "png":
+                doc[first - 1].get_pixmap(dpi=dpi).save(tmp, output="png")
+            else:
+                with fitz.open() as out:
+                    out.insert_pdf(doc, from_page=first - 1, to_page=last - 1)
+                    out.save(tmp, garbage=3, deflate=True)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _scan() -> int:
+    total = 0
+    for e in os.scandir(PAGE_CACHE_DIR):
+        if e.is_file() and ".tmp" not in e.name:
+            total += e.stat().st_size
+    return total
+
+def _evict(limit: int = PAGE_CACHE_BYTES, grace: float = PAGE_CACHE_GRACE):
+    """Найдавніше використані (mtime оновлюється при кожному влучанні) — геть, поки не влізе в ліміт.
+    Свіжіші за grace не чіпаємо (і щойно згенерований файл теж): кеш може ненадовго перевищити ліміт."""
+    global _used
+    files = []
+    for e in os.scandir(PAGE_CACHE_DIR):
+        if e.is_file() and ".tmp" not in e.name:
+            st = e.stat()
+            files.append((st.st_mtime, st.st_size, e.path))
+    _used = sum(f[1] for f in files)
+    for _, size, path in sorted(files):
+        if _used <= limit:
+            break
+        try:
+            # mtime перечитуємо перед самим видаленням: влучання в іншому процесі могло його оновити
+            if time.time() - os.stat(path).st_mtime < grace:
+                continue
+            os.remove(path)
+            _used -= size
+        except FileNotFoundError:
+            pass
+
+def get_pages(name: str, pages: str, fmt: str = "pdf", dpi: int = DPI_DEFAULT) -> Optional[Tuple[str, str]]:
+    """Шлях до готового файлу і ETag; None — документа немає. PageError — некоректний запит,
+    DocumentError — сам PDF битий."""
+    global _used
+    m = docs_store.catalog.entry(name)
+    if m is None:
+        return None
+    if fmt not in ("pdf", "png"):
+        raise PageError("format must be pdf or png")
+    first, last = parse_pages(pages)
+    if fmt == "png":
+        if first != last:
+            raise PageError("png is rendered for a single page")
+        if not DPI_MIN <= dpi <= DPI_MAX:
+            raise PageError(f"dpi must be {DPI_MIN}..{DPI_MAX}")
+    key = cache_key(m["sha1"], first, last, fmt, dpi)
+    path = os.path.join(PAGE_CACHE_DIR, key)
+    try:
+        os.utime(path)          # влучання: файл стає «свіжим» для LRU
+        PAGE_CACHE_TOTAL.inc(result="hit")
+    except FileNotFoundError:
+        import fitz  # PyMuPDF: імпорт при першому рендері, а не на старті API
+        # один fitz.open на промах: і межі сторінок, і рендер
+        try:
+            with fitz.open(os.path.join(docs_store.DOCS_DIR, name)) as doc:
+                parse_pages(pages, len(doc))
+                PAGE_CACHE_TOTAL.inc(result="miss")
+                os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+                _render(doc, path, first, last, fmt, dpi)
+        except RuntimeError as e:   # fitz.FileDataError і помилки MuPDF під час рендеру
+            raise DocumentError(f"cannot read {name}: {e}") from e
+        with _lock:
+            if _used is None:
+                _used = _scan()
+            else:
+                _used += os.path.getsize(path)
+            if _used > PAGE_CACHE_BYTES:
+                _evict()
+    return path, f'"{os.path.splitext(key)[0]}"'
+
+metrics.gauge("page_cache_bytes", "Bytes in the rendered-page cache (this process' view)", lambda: _used)
@@ -1,67 +1,1830 @@
-import os, pickle
-from typing import List, Dict
+import os, io, re, sys, json, mmap, time, struct, pickle, math, hashlib, threading, itertools
+from typing import List, Dict, Optional
 from dataclasses import dataclass
-import fitz  # PyMuPDF
-from rank_bm25 import BM25Okapi
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl   # блокування store/ між процесами (на Windows — лише в межах процесу)
+except ImportError:
+    fcntl = None
 
-INDEX_PATH = "store/lite_index.pkl"
+from docs_store import file_sha1
+import metrics
+
+DOCS_DIR = "docs"
+INDEX_PATH = "store/lite_index.json"      # маніфест: покоління + перелік сегментів
+LEGACY_INDEX_PATH = "store/lite_index.pkl"
+SEGMENTS_DIR = "store/segments"
+
+# Скільки процесів витягують сторінки при збірці (1 = послідовно)
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+PAGES_PER_TASK = 8
+TERM_CACHE_SIZE = 50_000
+BATCH_BLOCK_CELLS = 1 << 22   # search_many: внесків (запит, уривок) в одному блоці (~64 МБ)
+
+# Уривки: вікна по PASSAGE_TOKENS слів із кроком PASSAGE_STRIDE (перекриття), сніпет — SNIPPET_CHARS
+PASSAGE_TOKENS = int(os.getenv("PASSAGE_TOKENS", "100"))
+PASSAGE_STRIDE = int(os.getenv("PASSAGE_STRIDE", str(PASSAGE_TOKENS // 2)))
+SNIPPET_CHARS = 300
+# Позиції термів в уривках (фрази в лапках і бонус за близькість); 0 — сегменти без позицій
+INDEX_POSITIONS = os.getenv("INDEX_POSITIONS", "1") == "1"
+
+# Кеш результатів пошуку: бюджет у байтах і час життя запису
+QUERY_CACHE_BYTES = int(os.getenv("QUERY_CACHE_BYTES", str(8 << 20)))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+
+# Остання збірка: сторінки, час, pages/s — для підбору інстансу
+last_build_stats: Dict = {}
+
+# Параметри BM25 — ті самі, що в rank_bm25.BM25Okapi
+K1, B, EPSILON = 1.5, 0.75, 0.25
 
 def pdf_to_pages(path: str):
+    import fitz  # PyMuPDF: лише для збірки — процес, що тільки шукає, його не імпортує
     doc = fitz.open(path)
     for p in range(len(doc)):
         text = doc[p].get_text("text") or ""
         yield p+1, text
 
+_WORD = re.compile(r"\S+")
+_CORE = re.compile(r"[^\W_](?:.*[^\W_])?", re.S)   # слово без пунктуації по краях
+
 def tokenize(text: str):
-    return [t for t in (text or "").lower().split() if t.isalnum()]
+    """Слова в нижньому регістрі. Пунктуація й символи по краях відрізаються ("KPI," -> "kpi",
+    "№35" -> "35"), усередині слова лишаються ("x/z", "e-learning")."""
+    out = []
+    for t in (text or "").lower().split():
+        if not t.isalnum():
+            m = _CORE.search(t)
+            if not m:
+                continue
+            t = m.group()
+        out.append(t)
+    return out
+
+def token_spans(text: str):
+    """Ті самі токени, що tokenize(), з позиціями у вихідному тексті: [(термін, початок, кінець)]."""
+    out = []
+    for w in _WORD.finditer(text or ""):
+        t, (a, b) = w.group().lower(), w.span()
+        if not t.isalnum():
+            m = _CORE.search(t)
+            if not m:
+                continue
+            t, a, b = m.group(), a + m.start(), a + m.end()
+        out.append((t, a, b))
+    return out
+
+def passage_windows(n: int, size: int = PASSAGE_TOKENS, stride: int = PASSAGE_STRIDE):
+    """Діапазони токенів [a, b) вікон, що перекриваються; останнє вікно притиснуте до кінця сторінки."""
+    if n <= size:
+        return [(0, n)] if n else []
+    starts = list(range(0, n - size, stride)) + [n - size]
+    return [(a, a + size) for a in starts]
+
+def intern_tokens(tokens, vocab: Dict[str, int]):
+    """Токени сторінки -> (id термінів у порядку першої появи, частоти) як uint32-масиви;
+    нові терміни дописуються в словник vocab."""
+    tf: Dict[int, int] = {}
+    for t in tokens:
+        tid = vocab.get(t)
+        if tid is None:
+            tid = vocab[t] = len(vocab)
+        tf[tid] = tf.get(tid, 0) + 1
+    return np.fromiter(tf.keys(), np.uint32, len(tf)), np.fromiter(tf.values(), np.uint32, len(tf))
+
+def intern_positions(tokens, vocab: Dict[str, int]):
+    """Як intern_tokens, плюс позиції: для кожного терміна (у тому ж порядку) tf його позицій
+    в уривку за зростанням, усі підряд в одному uint16-масиві."""
+    at: Dict[int, list] = {}
+    for i, t in enumerate(tokens):
+        tid = vocab.get(t)
+        if tid is None:
+            tid = vocab[t] = len(vocab)
+        p = at.get(tid)
+        if p is None:
+            at[tid] = [i]
+        else:
+            p.append(i)
+    return (np.fromiter(at.keys(), np.uint32, len(at)),
+            np.fromiter(map(len, at.values()), np.uint32, len(at)),
+            np.fromiter(itertools.chain.from_iterable(at.values()), np.uint16, len(tokens)))
+
+def page_passages(text: str, vocab: Dict[str, int]):
+    """Уривки сторінки: [(початок, кінець у тексті, id термінів, частоти, довжина, позиції або None)].
+    Зберігаються лише зсуви в тексті сторінки, а не копії рядків."""
+    spans = token_spans(text)
+    out = []
+    for a, b in passage_windows(len(spans)):
+        words = [t for t, _, _ in spans[a:b]]
+        if INDEX_POSITIONS:
+            ids, tfs, pos = intern_positions(words, vocab)
+        else:
+            (ids, tfs), pos = intern_tokens(words, vocab), None
+        out.append((spans[a][1], spans[b - 1][2], ids, tfs, b - a, pos))
+    return out
+
+def _varint(values: np.ndarray):
+    """LEB128 для масиву невід'ємних чисел -> (байти, кількість байтів на число)."""
+    v = values.astype(np.uint64)
+    nb = np.ones(len(v), np.int64)
+    for bits in (7, 14, 21, 28):
+        nb += v >= (1 << bits)
+    out = np.empty(int(nb.sum()), np.uint8)
+    at = np.cumsum(nb) - nb
+    for k in range(int(nb.max()) if len(nb) else 0):
+        sel = nb > k
+        byte = (v[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(nb[sel] - 1 > k, np.uint64(0x80), np.uint64(0))
+        out[at[sel] + k] = byte
+    return out, nb
+
+def decode_positions(blob: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """Позиції з байтових діапазонів [starts[i], ends[i]) (дельти у varint) -> (номер діапазону, позиція)."""
+    starts, ends = starts.astype(np.int64), ends.astype(np.int64)
+    lens = ends - starts
+    total = int(lens.sum())
+    if not total:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    idx = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(total)
+    b = blob[idx].astype(np.int64)
+    last = b < 0x80                                   # останній байт кожного varint
+    first = np.concatenate([[True], last[:-1]])
+    vstart = np.flatnonzero(first)
+    k = np.arange(total) - np.repeat(vstart, np.diff(np.append(vstart, total)))
+    gaps = np.bincount(np.cumsum(first) - 1, weights=(b & 0x7F) << (7 * k)).astype(np.int64)
+    owner = np.repeat(np.arange(len(lens)), lens)[last]
+    # дельти -> позиції в межах кожного діапазону
+    cs = np.cumsum(gaps)
+    head = np.flatnonzero(np.concatenate([[True], owner[1:] != owner[:-1]]))
+    counts = np.diff(np.append(head, len(owner)))
+    return owner, cs - np.repeat(cs[head] - gaps[head], counts)
+
+# ---------- бінарний формат сегмента ----------
+# Заголовок, таблиця секцій (offset, count) і самі секції, вирівняні на 8 байт.
+# Терміни нумеруються в порядку першої появи (як у словнику BM25Okapi),
+# vocab_sorted — ті самі id у байтовому порядку для бінарного пошуку.
+# Документ BM25 — уривок: psg_page (рядок сторінки в сегменті) і psg_start/psg_end — зсуви
+# в тексті сторінки; lens — довжини уривків, pages/text_* — по одному запису на сторінку.
+# pos_ptr/pos_blob — позиції кожного постингу (дельти, varint), порожні без SEG_POSITIONS.
+# v2: токенізатор зберігає слова з пунктуацією по краях; v3: уривки замість цілих сторінок;
+# v4: позиції термів.
+SEG_MAGIC, SEG_VERSION = b"LCSG", 4
+SEG_FAILED, SEG_POSITIONS = 1, 2
+_HDR = struct.Struct("<4sIIIIHH")   # magic, version, flags, n_docs, n_terms, вікно, крок уривків
+_SECTIONS = [
+    ("vocab_off", np.uint64), ("vocab_blob", np.uint8), ("vocab_sorted", np.uint32),
+    ("post_ptr", np.uint64), ("post_docs", np.uint32), ("post_tfs", np.uint32),
+    ("lens", np.uint32), ("psg_page", np.uint32), ("psg_start", np.uint32), ("psg_end", np.uint32),
+    ("pages", np.uint32), ("text_off", np.uint64), ("text_blob", np.uint8),
+    ("pos_ptr", np.uint32), ("pos_blob", np.uint8),
+]
+
+class SegmentBuilder:
+    """Сегмент, що збирається посторінково. Терміни інтернуються в словник сегмента,
+    уривок — пара uint32-масивів (id, tf) і зсуви в тексті сторінки, без словників рядків."""
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.pages: List[int] = []
+        self.texts: List[bytes] = []
+        self.psg: List[tuple] = []          # (рядок сторінки, початок, кінець, довжина)
+        self.ids: List[np.ndarray] = []
+        self.tfs: List[np.ndarray] = []
+        self.pos: List[np.ndarray] = []
+
+    def __len__(self):
+        return len(self.psg)
+
+    def _add(self, page: int, text: str, passages, remap=None):
+        row = len(self.pages)
+        self.pages.append(page)
+        self.texts.append(text.encode())
+        for start, end, ids, tfs, length, pos in passages:
+            self.psg.append((row, start, end, length))
+            self.ids.append(ids if remap is None else remap[ids])
+            self.tfs.append(tfs)
+            if pos is not None:
+                self.pos.append(pos)
+
+    def add_text(self, page: int, text: str):
+        passages = page_passages(text, self.vocab)
+        if passages:
+            self._add(page, text, passages)
+
+    def add_chunk(self, vocab: List[str], pages):
+        """Сторінки від воркера з його локальним словником: id перекладаються у словник сегмента."""
+        remap = np.array([self.vocab.setdefault(t, len(self.vocab)) for t in vocab], np.uint32)
+        for page, text, passages in pages:
+            self._add(page, text, passages, remap)
+
+def _encode_positions(pos: List[np.ndarray], tfs: np.ndarray, order: np.ndarray):
+    """Позиції записів (уривок, термін) у порядку постингів: дельти в межах запису, varint.
+    -> (pos_ptr: байтовий зсув кожного постингу + кінець, pos_blob)."""
+    flat = np.concatenate(pos).astype(np.int64)
+    lens = tfs[order].astype(np.int64)
+    heads = np.cumsum(lens) - lens
+    src = (np.cumsum(tfs.astype(np.int64)) - tfs)[order]
+    p = flat[np.repeat(src - heads, lens) + np.arange(int(lens.sum()))]
+    first = np.zeros(len(p), bool)
+    first[heads] = True
+    gaps = np.where(first, p, p - np.concatenate([[0], p[:-1]]))
+    blob, nb = _varint(gaps)
+    ptr = np.concatenate([[0], np.cumsum(np.add.reduceat(nb, heads))])
+    return ptr, blob
+
+def encode_segment(b: SegmentBuilder, failed: bool = False) -> bytes:
+    terms = [t.encode() for t in b.vocab]
+    tids = np.concatenate(b.ids) if b.ids else np.empty(0, np.uint32)
+    docs = np.repeat(np.arange(len(b), dtype=np.uint32), [len(a) for a in b.ids])
+    tfs = np.concatenate(b.tfs) if b.tfs else np.empty(0, np.uint32)
+    order = np.argsort(tids, kind="stable")   # у межах терміна doc id зростають
+    psg = np.array(b.psg, np.uint32).reshape(-1, 4)
+    positions = len(b.pos) == len(b.ids) and bool(b.pos)
+    pos_ptr, pos_blob = _encode_positions(b.pos, tfs, order) if positions else (np.empty(0), np.empty(0))
+    arrays = {
+        "vocab_off": np.cumsum([0] + [len(t) for t in terms], dtype=np.uint64),
+        "vocab_blob": np.frombuffer(b"".join(terms), np.uint8),
+        "vocab_sorted": np.array(sorted(range(len(terms)), key=terms.__getitem__), np.uint32),
+        "post_ptr": np.concatenate([[0], np.cumsum(np.bincount(tids, minlength=len(terms)))]),
+        "post_docs": docs[order],
+        "post_tfs": tfs[order],
+        "lens": psg[:, 3], "psg_page": psg[:, 0], "psg_start": psg[:, 1], "psg_end": psg[:, 2],
+        "pages": np.array(b.pages, np.uint32),
+        "text_off": np.cumsum([0] + [len(t) for t in b.texts], dtype=np.uint64),
+        "text_blob": np.frombuffer(b"".join(b.texts), np.uint8),
+        "pos_ptr": pos_ptr, "pos_blob": pos_blob,
+    }
+    flags = (SEG_FAILED if failed else 0) | (SEG_POSITIONS if positions else 0)
+    out = io.BytesIO()
+    out.write(_HDR.pack(SEG_MAGIC, SEG_VERSION, flags, len(b), len(terms), PASSAGE_TOKENS, PASSAGE_STRIDE))
+    table_at = out.tell()
+    out.write(b"\0" * 16 * len(_SECTIONS))
+    table = []
+    for key, dt in _SECTIONS:
+        out.write(b"\0" * (-out.tell() % 8))
+        a = np.ascontiguousarray(arrays[key], dt)
+        table += [out.tell(), a.size]
+        out.write(a.tobytes())
+    out.seek(table_at)
+    out.write(np.array(table, np.uint64).tobytes())
+    return out.getvalue()
+
+class Segment:
+    """Один PDF у вигляді масивів поверх буфера (mmap файлу або bytes) — без копій і pickle."""
+
+    def __init__(self, buf, name: str, sha1: str, mtime: float = 0.0, size: int = 0):
+        magic, version, flags, self.n_docs, self.n_terms, *window = _HDR.unpack_from(buf, 0)
+        if magic != SEG_MAGIC or version != SEG_VERSION:
+            raise ValueError(f"unsupported segment format {magic!r} v{version}")
+        self.failed = bool(flags & SEG_FAILED)
+        self.positions = bool(flags & SEG_POSITIONS)
+        self.window = tuple(window)
+        self.name, self.sha1, self.mtime, self.size = name, sha1, mtime, size
+        self.nbytes = len(buf)
+        self._buf = buf
+        self._bounds = None
+        table = np.frombuffer(buf, np.uint64, 2 * len(_SECTIONS), _HDR.size)
+        for (key, dt), off, count in zip(_SECTIONS, table[::2], table[1::2]):
+            arr = np.frombuffer(buf, dt, int(count), int(off)) if count else np.empty(0, dt)
+            setattr(self, key, arr)
+        self.n_pages = len(self.pages)
+
+    def stale(self) -> bool:
+        """Битий PDF, уривки нарізані іншим вікном або бракує позицій — сегмент треба перебудувати."""
+        return (self.failed or self.window != (PASSAGE_TOKENS, PASSAGE_STRIDE)
+                or (INDEX_POSITIONS and not self.positions and self.n_docs > 0))
+
+    def positions_nbytes(self) -> int:
+        return self.pos_ptr.nbytes + self.pos_blob.nbytes
+
+    def prefetch(self):
+        """Просить ОС наперед підтягнути файл у сторінковий кеш: інакше перший пошук ловить
+        page fault на кожній секції, яку зачепить."""
+        if isinstance(self._buf, mmap.mmap) and hasattr(mmap, "MADV_WILLNEED"):
+            self._buf.madvise(mmap.MADV_WILLNEED)
+
+    @classmethod
+    def open(cls, path: str, name: str, sha1: str, mtime: float = 0.0, size: int = 0) -> "Segment":
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf, name, sha1, mtime, size)
+
+    def _term(self, tid: int) -> bytes:
+        return self.vocab_blob[self.vocab_off[tid]:self.vocab_off[tid + 1]].tobytes()
+
+    def terms(self) -> List[str]:
+        """Усі терміни в порядку id (порядок першої появи)."""
+        raw, off = self.vocab_blob.tobytes(), self.vocab_off.tolist()
+        return [raw[off[i]:off[i + 1]].decode() for i in range(self.n_terms)]
+
+    def term_id(self, term: str) -> int:
+        key, lo, hi = term.encode(), 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(int(self.vocab_sorted[mid])) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms:
+            tid = int(self.vocab_sorted[lo])
+            if self._term(tid) == key:
+                return tid
+        return -1
+
+    def dfs(self) -> np.ndarray:
+        return np.diff(self.post_ptr)
+
+    def postings(self, tid: int):
+        a, b = int(self.post_ptr[tid]), int(self.post_ptr[tid + 1])
+        return self.post_docs[a:b], self.post_tfs[a:b]
+
+    def bounds(self):
+        """(максимальний tf, мінімальна довжина уривка) для кожного терміна — рахуються раз на сегмент."""
+        if self._bounds is None and self.n_terms:
+            starts = self.post_ptr[:-1].astype(np.intp)
+            self._bounds = (np.maximum.reduceat(self.post_tfs, starts),
+                            np.minimum.reduceat(self.lens[self.post_docs], starts))
+        return self._bounds
+
+    def term_bound(self, tid: int, avgdl: float) -> float:
+        """Верхня межа tf-частини BM25 для терміна: максимальний tf при мінімальній довжині уривка."""
+        tf_max, dl_min = self.bounds()
+        tf, dl = float(tf_max[tid]), float(dl_min[tid])
+        return tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+
+    def text(self, i: int) -> str:
+        """Текст i-ї сторінки сегмента (не уривка)."""
+        return self.text_blob[self.text_off[i]:self.text_off[i + 1]].tobytes().decode()
+
+    def meta(self, i: int) -> Dict:
+        return {"doc_id": os.path.splitext(self.name)[0], "page": int(self.pages[i]),
+                "source_path": os.path.join(DOCS_DIR, self.name)}
+
+def _segment_path(sha1: str) -> str:
+    return os.path.join(SEGMENTS_DIR, f"{sha1}.seg")
+
+def _atomic_write(path: str, data: bytes):
+    """Тимчасовий файл + rename: читач бачить або старий файл, або новий повністю — ніколи не обрізаний."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(folder)
+
+def _fsync_dir(folder: str):
+    try:   # сам rename теж має пережити падіння машини
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:     # Windows: каталог так не відкрити
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_segment(name: str, sha1: str, b: SegmentBuilder, failed: bool = False) -> Segment:
+    path = os.path.join(DOCS_DIR, name)
+    st = os.stat(path) if os.path.exists(path) else None
+    mtime, size = (st.st_mtime, st.st_size) if st else (0.0, 0)
+    _atomic_write(_segment_path(sha1), encode_segment(b, failed))
+    return Segment.open(_segment_path(sha1), name, sha1, mtime, size)
+
+def _reuse_segment(name: str, prev: Optional[Segment] = None):
+    """(сегмент, sha1) з попереднього індексу чи кешу; (None, sha1), якщо PDF треба читати."""
+    path = os.path.join(DOCS_DIR, name)
+    st = os.stat(path)
+    if prev and not prev.stale() and prev.mtime == st.st_mtime and prev.size == st.st_size:
+        return prev, prev.sha1
+    sha1 = file_sha1(path)
+    if prev and not prev.stale() and prev.sha1 == sha1:
+        prev.mtime, prev.size = st.st_mtime, st.st_size
+        return prev, sha1
+    cache = _segment_path(sha1)
+    if os.path.exists(cache):
+        try:
+            seg = Segment.open(cache, name, sha1, st.st_mtime, st.st_size)
+            if not seg.stale():
+                return seg, sha1
+        except Exception as e:
+            print(f"[warn] bad segment cache {cache}: {e}")
+    return None, sha1
+
+# ---------- паралельне витягання сторінок ----------
+def _extract_chunk(task):
+    """Воркер пулу: уривки сторінок одного PDF як масиви id термінів у локальному словнику задачі.
+    Назад через pickle їдуть лише словник, тексти й uint32-масиви, а не Counter рядків."""
+    import fitz
+    name, path, start, stop = task
+    vocab: Dict[str, int] = {}
+    out = []
+    try:
+        doc = fitz.open(path)
+        for p in range(start, stop):
+            text = doc[p].get_text("text") or ""
+            passages = page_passages(text, vocab)
+            if passages:
+                out.append((p + 1, text, passages))
+        return name, (list(vocab), out), None
+    except Exception as e:
+        return name, (list(vocab), out), str(e)
+
+def _chunk_result(name, fut):
+    try:
+        return fut.result()
+    except Exception as e:  # впав сам воркер (напр. BrokenProcessPool)
+        return name, ([], []), f"{type(e).__name__}: {e}"
+
+def _ordered(pool, tasks, window: int):
+    """Результати задач у порядку подачі; у польоті не більше window задач, щоб готові
+    сторінки не накопичувались у пам'яті швидше, ніж пишуться сегменти."""
+    pending = deque()
+    for t in tasks:
+        pending.append((t[0], pool.submit(_extract_chunk, t)))
+        if len(pending) >= window:
+            yield _chunk_result(*pending.popleft())
+    while pending:
+        yield _chunk_result(*pending.popleft())
+
+def extract_segments(jobs, workers: Optional[int] = None) -> Dict[str, Segment]:
+    """jobs: [(name, sha1)]. Сторінки ріжуться на задачі по PAGES_PER_TASK і розходяться
+    по пулу процесів; результати забираються в порядку подачі, тож індекс детермінований.
+    Сегмент пишеться, щойно прийшла остання задача його PDF, — у пам'яті лише поточні."""
+    workers = max(1, workers or INDEX_WORKERS)
+    t0 = time.perf_counter()
+    sha1s, left, tasks, failed = dict(jobs), {}, [], set()
+    for name, _ in jobs:
+        import fitz   # лише коли є що читати: індекс із кешу чи знімка PyMuPDF не торкається
+        path = os.path.join(DOCS_DIR, name)
+        left[name] = 0
+        try:
+            with fitz.open(path) as doc:
+                n = len(doc)
+        except Exception as e:
+            print(f"[warn] failed {name}: {e}")
+            failed.add(name)
+            continue
+        for start in range(0, n, PAGES_PER_TASK):
+            tasks.append((name, path, start, min(start + PAGES_PER_TASK, n)))
+            left[name] += 1
+
+    segments, builders, total = {}, {}, 0
+
+    def finish(name):
+        nonlocal total
+        b = builders.pop(name, None) or SegmentBuilder()
+        total += len(b.pages)
+        # битий PDF позначається прапорцем — його перечитаємо при наступній збірці
+        segments[name] = write_segment(name, sha1s[name], b, name in failed)
+
+    for name in [n for n, c in left.items() if not c]:
+        finish(name)
+    pool = ProcessPoolExecutor(min(workers, len(tasks))) if workers > 1 and len(tasks) > 1 else None
+    try:
+        results = _ordered(pool, tasks, 4 * workers) if pool else map(_extract_chunk, tasks)
+        for name, (vocab, chunk), err in results:
+            builders.setdefault(name, SegmentBuilder()).add_chunk(vocab, chunk)
+            if err:
+                if name not in failed:
+                    print(f"[warn] failed {name}: {err}")
+                failed.add(name)
+            left[name] -= 1
+            if not left[name]:
+                finish(name)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    dt = max(time.perf_counter() - t0, 1e-9)
+    last_build_stats.update(pdfs=len(jobs), failed=len(failed), pages=total, workers=workers,
+                            seconds=round(dt, 3), pages_per_sec=round(total / dt, 1))
+    if jobs:
+        print(f"[index] extracted {total} pages from {len(jobs)} PDFs in {dt:.2f}s "
+              f"({total / dt:.1f} pages/s, workers={workers})", flush=True)
+    return {name: segments[name] for name, _ in jobs}
+
+def load_segment(name: str, prev: Optional[Segment] = None, workers: Optional[int] = None) -> Segment:
+    """Сегмент для docs/<name>: з попереднього індексу, з кешу за sha1 або заново з PDF."""
+    seg, sha1 = _reuse_segment(name, prev)
+    return seg or extract_segments([(name, sha1)], workers)[name]
+
+# ---------- кеш результатів ----------
+def _result_size(key, res) -> int:
+    size = sys.getsizeof(key) + sum(sys.getsizeof(t) for t in key[0]) + sys.getsizeof(res)
+    for m in res:
+        size += sys.getsizeof(m) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in m.items())
+        size += sum(sys.getsizeof(h) for h in m.get("highlights", ()))
+    return size
+
+class QueryCache:
+    """LRU + TTL кеш результатів search(), обмежений за байтами.
+
+    Записи прив'язані до покоління індексу: щойно приходить запит до іншого
+    покоління (після build_index() чи index_document()), кеш очищується."""
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_BYTES, ttl: float = QUERY_CACHE_TTL):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self._data: OrderedDict = OrderedDict()   # key -> (expires, size, res)
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.invalidations = 0
+
+    def _sync(self, generation):
+        if generation != self._generation:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def _drop(self, key):
+        self._bytes -= self._data.pop(key)[1]
+
+    def get(self, generation, key):
+        with self._lock:
+            self._sync(generation)
+            item = self._data.get(key)
+            if item is not None and item[0] < time.monotonic():
+                self._drop(key)
+                self.expired += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def put(self, generation, key, res):
+        size = _result_size(key, res)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._sync(generation)
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, res)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expired": self.expired, "invalidations": self.invalidations}
+
+query_cache = QueryCache()
+
+# ---------- метрики ----------
+INDEX_SECONDS = metrics.histogram("index_op_seconds", "Index load/build/update latency", ("op",),
+                                  buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+SEARCH_SECONDS = metrics.histogram("search_seconds", "LiteIndex search latency, query cache included", ("kind",))
+metrics.gauge("search_cache", "Query cache counters and size", lambda: {
+    k: v for k, v in query_cache.stats().items() if k != "max_bytes"}, ("stat",))
+metrics.gauge("index_last_build", "Last build_index() run: pages, seconds, pages/s, peak RSS",
+              lambda: {k: v for k, v in last_build_stats.items() if isinstance(v, (int, float))}, ("stat",))
+metrics.gauge("index_info", "Loaded index: generation, pages, passages, segments", lambda: {
+    "generation": _cached.generation, "pages": len(_cached), "passages": _cached.n,
+    "segments": len(_cached.segments)} if _cached is not None else {}, ("stat",))
+
+# ---------- нечіткий пошук ----------
+# Терміни запиту, яких немає в словнику, розширюються схожими словами: кандидати — за спільними
+# триграмами, перевірка — відстанню Дамерау-Левенштейна. Індекс триграм будується у фоні
+# для кожного покоління (з різниці з попереднім); поки він не готовий, пошук іде без розширення.
+FUZZY_SEARCH = os.getenv("FUZZY_SEARCH", "1") == "1"          # типове значення fuzzy у search()
+FUZZY_BUDGET_MS = float(os.getenv("FUZZY_BUDGET_MS", "15"))   # на розширення всіх термів запиту
+FUZZY_MIN_LEN = 4             # коротші слова не виправляємо: надто багато сусідів
+FUZZY_CANDIDATES = 64         # кандидатів на перевірку відстанню
+FUZZY_EXPANSIONS = 3          # слів, якими замінюється один термін
+FUZZY_PENALTY = 0.7           # множник idf за кожну правку
+FUZZY_CACHE_SIZE = 10_000
+FUZZY_MAX_CHUNKS = 8          # дописаних шматків триграм до повної перебудови
+
+FUZZY_TOTAL = metrics.counter("search_fuzzy_total", "Unknown query terms by fuzzy expansion outcome", ("result",))
+
+# латинські літери, що виглядають як кириличні (і навпаки) — змішана розкладка на телефоні
+_LAT2CYR = str.maketrans("aceiopxykmthb", "асеіорхукмтнв")
+_CYR2LAT = str.maketrans("асеіорхукмтнв", "aceiopxykmthb")
+_LATIN = re.compile(r"[a-z]")
+_CYRILLIC = re.compile(r"[а-яіїєґё]")
+
+def _trigrams(term: str) -> set:
+    t = f"^{term}$"
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+def _fold_scripts(term: str) -> Optional[str]:
+    """Слово зі змішаних латиниці й кирилиці -> у скрипт більшості літер; None, якщо не змішане."""
+    lat, cyr = len(_LATIN.findall(term)), len(_CYRILLIC.findall(term))
+    if not lat or not cyr:
+        return None
+    return term.translate(_LAT2CYR if cyr >= lat else _CYR2LAT)
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Дамерау-Левенштейн (перестановка сусідніх літер — одна правка); > limit -> limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class FuzzyIndex:
+    """Триграми словника всіх сегментів у CSR-масивах: триграма -> номери термінів.
+    Нове покоління не будується з нуля: build() бере індекс попереднього, дописує шматок CSR лише
+    з нових термінів доданих сегментів і поправляє df на внесок доданих і зниклих сегментів.
+    Терміни зниклих сегментів лишаються з df 0 і пропускаються; коли їх чи шматків забагато —
+    повна перебудова."""
+
+    def __init__(self, base: Optional["FuzzyIndex"] = None, added=(), removed=()):
+        self.ids: Dict[str, int] = dict(base.ids) if base else {}     # термін -> номер
+        self.terms: List[str] = list(base.terms) if base else []
+        self.contrib: Dict[tuple, tuple] = dict(base.contrib) if base else {}   # (name, sha1) -> (номери, df)
+        self.chunks: List[tuple] = list(base.chunks) if base else []  # (gram_ids, ptr, post)
+        df = base.df.copy() if base else np.empty(0, np.int64)
+        for key in removed:
+            ids, f = self.contrib.pop(key)
+            df[ids] -= f
+        n0, fresh = len(self.terms), []
+        for seg in added:
+            ids, fs = [], []
+            for t, f in zip(seg.terms(), seg.dfs().tolist()):
+                if len(t) < FUZZY_MIN_LEN - 1 or t.isdigit():
+                    continue
+                i = self.ids.get(t)
+                if i is None:
+                    i = self.ids[t] = len(self.terms)
+                    self.terms.append(t)
+                    fresh.append(t)
+                ids.append(i)
+                fs.append(f)
+            self.contrib[(seg.name, seg.sha1)] = (np.array(ids, np.int64), np.array(fs, np.int64))
+        self.df = np.concatenate([df, np.zeros(len(fresh), np.int64)])
+        for seg in added:
+            ids, f = self.contrib[(seg.name, seg.sha1)]
+            self.df[ids] += f
+        self.lens = np.array([len(t) for t in self.terms], np.uint16)
+        if fresh:
+            grams: Dict[str, List[int]] = {}
+            for i, t in enumerate(fresh, n0):
+                for g in _trigrams(t):
+                    grams.setdefault(g, []).append(i)
+            ptr = np.cumsum([0] + [len(v) for v in grams.values()]).astype(np.int64)
+            post = np.fromiter(itertools.chain.from_iterable(grams.values()), np.uint32, int(ptr[-1]))
+            self.chunks.append(({g: j for j, g in enumerate(grams)}, ptr, post))
+        self._cache: Dict[str, list] = {}
+
+    @classmethod
+    def build(cls, segments, base: Optional["FuzzyIndex"] = None) -> "FuzzyIndex":
+        """Індекс для набору сегментів; з base — лише різниця з ним (той самий набір — сам base)."""
+        live = {(s.name, s.sha1): s for s in segments}
+        if base is not None and base.contrib.keys() == live.keys():
+            return base
+        if base is not None and len(base.chunks) < FUZZY_MAX_CHUNKS:
+            fz = cls(base, [s for k, s in live.items() if k not in base.contrib],
+                     [k for k in base.contrib if k not in live])
+            if (fz.df == 0).sum() * 4 <= len(fz.terms):
+                return fz
+        return cls(None, list(live.values()))
+
+    def nbytes(self) -> int:
+        return (self.df.nbytes + self.lens.nbytes + sum(p.nbytes + q.nbytes + sys.getsizeof(g) * 2
+                                                        for g, p, q in self.chunks)
+                + sum(a.nbytes + b.nbytes for a, b in self.contrib.values())
+                + sum(sys.getsizeof(t) for t in self.terms) + sys.getsizeof(self.ids))
+
+    def expand(self, term: str) -> List[tuple]:
+        """[(слово зі словника, кількість правок), ...] — найближчі, частіші першими."""
+        hit = self._cache.get(term)
+        if hit is None:
+            hit = self._expand(term)
+            if len(self._cache) >= FUZZY_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[term] = hit
+        return hit
+
+    def _expand(self, term: str) -> List[tuple]:
+        limit = 1 if len(term) <= 7 else 2
+        lists = []
+        for g in _trigrams(term):
+            for gram_ids, ptr, post in self.chunks:    # кожен термін — рівно в одному шматку
+                j = gram_ids.get(g)
+                if j is not None:
+                    lists.append(post[ptr[j]:ptr[j + 1]])
+        if not lists:
+            return []
+        ids, shared = np.unique(np.concatenate(lists), return_counts=True)
+        # одна правка зачіпає щонайбільше 3 триграми (перестановка — 4); df 0 — слово зниклого сегмента
+        keep = (shared >= max(1, len(term) - 4 * limit)) & (self.df[ids] > 0) & \
+               (np.abs(self.lens[ids].astype(np.int64) - len(term)) <= limit)
+        ids, shared = ids[keep], shared[keep]
+        if len(ids) > FUZZY_CANDIDATES:
+            top = np.argpartition(-shared, FUZZY_CANDIDATES)[:FUZZY_CANDIDATES]
+            ids = ids[top]
+        found = []
+        for i in ids.tolist():
+            d = edit_distance(term, self.terms[i], limit)
+            if d <= limit:
+                found.append((d, -int(self.df[i]), self.terms[i]))
+        found.sort()
+        best = found[0][0] if found else 0
+        return [(t, d) for d, _, t in found if d == best][:FUZZY_EXPANSIONS]
+
+# ---------- фрази й близькість ----------
+PROXIMITY_BOOST = os.getenv("PROXIMITY_BOOST", "1") == "1"      # типове значення proximity у search()
+PROXIMITY_WEIGHT = float(os.getenv("PROXIMITY_WEIGHT", "1.0"))  # сусідні терміни: +вага·min(idf), далі /d²
+_PHRASE = re.compile(r'["«“„]([^"«»“”„]+)["»”“]')
+
+def parse_phrases(query: str) -> tuple:
+    """Фрази в лапках ("..." «...» „...“) -> кортеж кортежів токенів; однослівні не враховуються."""
+    out = []
+    for m in _PHRASE.finditer(query or ""):
+        toks = tokenize(m.group(1))
+        if len(toks) > 1:
+            out.append(tuple(toks))
+    return tuple(out)
+
+def _vocab_df(segments) -> Dict[str, int]:
+    df: Dict[str, int] = {}
+    for seg in segments:
+        for term, f in zip(seg.terms(), seg.dfs().tolist()):
+            df[term] = df.get(term, 0) + f
+    return df
+
+# ---------- індекс ----------
+_merge_lock = threading.Lock()
+_epochs = itertools.count(1)
 
 @dataclass
 class LiteIndex:
-    corpus: list
-    meta: list
-    bm25: BM25Okapi
+    segments: Dict[str, Segment]
+    generation: int = 0
+    avg_idf: Optional[float] = None   # середній idf по всьому словнику (для EPSILON-підлоги)
+    started: float = 0.0              # time.time() початку збірки, що звела це покоління з docs/
+
+    def __post_init__(self):
+        segs = list(self.segments.values())
+        self._segs = segs
+        self._base = np.cumsum([0] + [s.n_docs for s in segs])     # перший уривок сегмента
+        self._pbase = np.cumsum([0] + [s.n_pages for s in segs])   # перша сторінка сегмента
+        self._lens = np.concatenate([s.lens for s in segs]) if segs else np.empty(0, np.uint32)
+        # глобальний номер сторінки для кожного уривка
+        self._pg = (np.concatenate([s.psg_page + np.uint32(b) for s, b in zip(segs, self._pbase)])
+                    if segs else np.empty(0, np.uint32))
+        self.n = len(self._lens)            # N для BM25 — кількість уривків
+        self.n_pages = int(self._pbase[-1])
+        self.avgdl = int(self._lens.sum(dtype=np.uint64)) / self.n if self.n else 0.0
+        self._terms: Dict[str, tuple] = {}   # кеш: термін -> (df, {номер сегмента: tid})
+        self._epoch = next(_epochs)          # відрізняє два індекси з однаковим generation
+        self._fuzzy: Optional[FuzzyIndex] = None
+        self._fuzzy_thread: Optional[threading.Thread] = None
+        self.positions = bool(segs) and all(s.positions or not s.n_docs for s in segs)
+
+    def __len__(self):
+        return self.n_pages
+
+    def stats(self):
+        """Глобальні N, avgdl і середній idf, зведені з усіх сегментів (раз на покоління)."""
+        if self.avg_idf is None:
+            with _merge_lock:
+                if self.avg_idf is None:
+                    self.avg_idf = _average_idf(self.segments.values(), self.n)
+        return self.n, self.avgdl, self.avg_idf
+
+    def warm(self) -> float:
+        """Прогрів свіжовідкритого покоління, щоб перший запит коштував як усі наступні: сторінки
+        сегментів у кеш ОС, межі MaxScore, середній idf, (з FUZZY_SEARCH) індекс триграм і пробний
+        пошук повз кеш запитів — перші виклики numpy і сніпетів теж недешеві."""
+        t0 = time.perf_counter()
+        with INDEX_SECONDS.time(op="warm"):
+            for s in self._segs:
+                s.prefetch()
+                s.bounds()
+            self.stats()
+            if FUZZY_SEARCH:
+                self.fuzzy_index(wait=True)
+            probe = next((tokenize(s.text(0))[:2] for s in self._segs if s.n_docs), [])
+            if probe:
+                self._search(probe, 6, proximity=PROXIMITY_BOOST and self.positions)
+        return time.perf_counter() - t0
 
-    def search(self, query: str, k: int = 6):
-        if not query or not self.corpus:
+    def memory_stats(self) -> Dict:
+        """Пам'ять завантаженого індексу: mmap-сегменти (сторінковий кеш ОС, спільний між
+        процесами) окремо від власної купи — масивів довжин, меж MaxScore і кешу термінів."""
+        heap = self._lens.nbytes + self._pg.nbytes + self._base.nbytes + self._pbase.nbytes
+        heap += sum(b.nbytes for s in self._segs if s._bounds is not None for b in s._bounds)
+        terms = dict(self._terms)
+        heap += sys.getsizeof(terms) + sum(sys.getsizeof(t) + sys.getsizeof(v) + sys.getsizeof(v[1])
+                                           for t, v in terms.items())
+        return {"segments": len(self._segs), "pages": self.n_pages, "passages": self.n,
+                "terms_cached": len(terms), "fuzzy_bytes": self._fuzzy.nbytes() if self._fuzzy else 0,
+                "mapped_bytes": sum(s.nbytes for s in self._segs), "heap_bytes": heap,
+                "positions_bytes": sum(s.positions_nbytes() for s in self._segs),
+                "rss_anon_bytes": _rss("RssAnon"), "rss_file_bytes": _rss("RssFile")}
+
+    def lookup(self, term: str):
+        """(глобальний df, {номер сегмента: tid}) — бінарний пошук по словниках один раз на термін."""
+        hit = self._terms.get(term)
+        if hit is None:
+            df, tids = 0, {}
+            for si, seg in enumerate(self._segs):
+                tid = seg.term_id(term)
+                if tid >= 0:
+                    tids[si] = tid
+                    df += int(seg.post_ptr[tid + 1] - seg.post_ptr[tid])
+            if len(self._terms) >= TERM_CACHE_SIZE:
+                self._terms.clear()
+            hit = self._terms[term] = (df, tids)
+        return hit
+
+    def idf(self, term: str) -> float:
+        n, _, avg_idf = self.stats()
+        df = self.lookup(term)[0]
+        if not df:
+            return 0.0
+        v = math.log(n - df + 0.5) - math.log(df + 0.5)
+        return v if v >= 0 else EPSILON * avg_idf
+
+    def fuzzy_index(self, wait: bool = False) -> Optional[FuzzyIndex]:
+        """Індекс триграм цього покоління. Перший виклик запускає фонову збірку; без wait
+        повертає None, доки вона не закінчиться."""
+        if self._fuzzy is None:
+            with _merge_lock:
+                if self._fuzzy_thread is None:
+                    self._fuzzy_thread = threading.Thread(target=self._build_fuzzy, name="fuzzy-index", daemon=True)
+                    self._fuzzy_thread.start()
+            if wait:
+                self._fuzzy_thread.join()
+        return self._fuzzy
+
+    def _build_fuzzy(self):
+        # від індексу триграм поточного покоління процесу: додати різницю дешевше, ніж усе заново
+        prev = _cached
+        base = prev._fuzzy if prev is not None and prev is not self else None
+        try:
+            with INDEX_SECONDS.time(op="fuzzy" if base is None else "fuzzy_update"):
+                self._fuzzy = FuzzyIndex.build(self._segs, base)
+        except Exception as e:
+            print(f"[warn] fuzzy index: {e}")
+
+    def expand(self, q: List[str]):
+        """Нечітке розширення токенів запиту. -> (токени, {заміна: множник idf}, {невідомий термін:
+        [заміни]}, complete). complete=False — індекс триграм ще не готовий або вичерпано
+        FUZZY_BUDGET_MS, тож частину термів не розширено і результат не варто кешувати."""
+        out, weights, fixes, complete = [], {}, {}, True
+        fz, t0 = None, time.perf_counter()
+        for t in q:
+            if self.lookup(t)[0]:
+                out.append(t)
+                continue
+            folded = _fold_scripts(t)
+            if folded and self.lookup(folded)[0]:
+                subs = [(folded, 0)]
+            elif len(t) < FUZZY_MIN_LEN or t.isdigit() or not complete:
+                out.append(t)
+                continue
+            else:
+                fz = fz or self.fuzzy_index()
+                late = (time.perf_counter() - t0) * 1000 > FUZZY_BUDGET_MS
+                if fz is None or late:
+                    FUZZY_TOTAL.inc(result="budget" if fz else "not_ready")
+                    complete = False
+                    out.append(t)
+                    continue
+                subs = fz.expand(t)
+            FUZZY_TOTAL.inc(result="expanded" if subs else "none")
+            if not subs:
+                out.append(t)
+                continue
+            fixes[t] = [w for w, _ in subs]
+            for w, d in subs:
+                out.append(w)
+                if w not in q:
+                    weights[w] = max(weights.get(w, 0.0), FUZZY_PENALTY ** d)
+        return out, weights, fixes, complete
+
+    def corrections(self, query: str) -> Dict[str, List[str]]:
+        """Які слова запиту нечіткий пошук замінив і на що (для «можливо, ви мали на увазі»)."""
+        return self.expand(tokenize(query))[2] if self.n else {}
+
+    def _postings(self, tids: Dict[int, int]):
+        """Постинги терміна з усіх сегментів у глобальній нумерації уривків (відсортовані)."""
+        parts = [(self._segs[si].postings(tid), self._base[si]) for si, tid in sorted(tids.items())]
+        docs = np.concatenate([d.astype(np.int64) + b for (d, _), b in parts])
+        tfs = np.concatenate([tf for (_, tf), _ in parts])
+        return docs, tfs
+
+    def _positions(self, tids: Dict[int, int], docs: np.ndarray):
+        """Позиції терміна в уривках docs (відсортовані, усі є в його постингах) -> (уривок, позиція).
+        Декодуються лише ці постинги, а не весь список терміна."""
+        out_d, out_p = [], []
+        for si, tid in sorted(tids.items()):
+            seg, base = self._segs[si], int(self._base[si])
+            lo, hi = np.searchsorted(docs, [base, base + seg.n_docs])
+            if lo == hi:
+                continue
+            a, b = int(seg.post_ptr[tid]), int(seg.post_ptr[tid + 1])
+            sel = docs[lo:hi]
+            at = a + np.searchsorted(seg.post_docs[a:b], sel - base)
+            owner, pos = decode_positions(seg.pos_blob, seg.pos_ptr[at], seg.pos_ptr[at + 1])
+            out_d.append(sel[owner])
+            out_p.append(pos)
+        if not out_d:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        return np.concatenate(out_d), np.concatenate(out_p)
+
+    def _phrase_docs(self, phrases, docs: Dict[str, np.ndarray]):
+        """Уривки, що містять кожну фразу: позиції декодуються лише для перетину постингів її термів,
+        і цей перетин звужується після кожного наступного терміна."""
+        common = None
+        for phrase in phrases:
+            if any(t not in docs for t in phrase):
+                return np.empty(0, np.int64)
+            for t in set(phrase):
+                common = docs[t] if common is None else np.intersect1d(common, docs[t], assume_unique=True)
+            keys = None
+            for j, t in enumerate(phrase):
+                d, p = self._positions(self.lookup(t)[1], common)
+                ok = p >= j
+                kj = np.unique((d[ok] << 20) | (p[ok] - j))      # (уривок, початок фрази)
+                keys = kj if keys is None else np.intersect1d(keys, kj, assume_unique=True)
+                common = np.unique(keys >> 20)
+                if not len(common):
+                    return common
+        return common
+
+    def _proximity(self, q: List[str], docs: Dict[str, np.ndarray], idf: Dict[str, float], cand=None):
+        """Бонус за близькість сусідніх термів запиту: Σ по парах PROXIMITY_WEIGHT·min(idf)/d²,
+        d — найменша відстань між ними в уривку. Лише для уривків, де є обидва терміни пари.
+        -> (уривки за зростанням, бонуси)."""
+        terms = [t for t, _ in itertools.groupby(t for t in q if t in docs)]
+        acc_d, acc_b = [], []
+        for a, b in zip(terms, terms[1:]):
+            common = np.intersect1d(docs[a], docs[b], assume_unique=True)
+            if cand is not None:
+                common = np.intersect1d(common, cand, assume_unique=True)
+            w = PROXIMITY_WEIGHT * max(min(idf[a], idf[b]), 0.0)
+            if not len(common) or w <= 0:
+                continue
+            da, pa = self._positions(self.lookup(a)[1], common)
+            db, pb = self._positions(self.lookup(b)[1], common)
+            d, p = np.concatenate([da, db]), np.concatenate([pa, pb])
+            side = np.concatenate([np.zeros(len(da), bool), np.ones(len(db), bool)])
+            o = np.lexsort((p, d))
+            d, p, side = d[o], p[o], side[o]
+            pair = (d[1:] == d[:-1]) & (side[1:] != side[:-1])
+            dist, dd = (p[1:] - p[:-1])[pair], d[1:][pair]
+            u, first = np.unique(dd, return_index=True)
+            acc_d.append(u)
+            acc_b.append(w / np.minimum.reduceat(dist, first).astype(np.float64) ** 2)
+        if not acc_d:
+            return np.empty(0, np.int64), np.empty(0)
+        u, inv = np.unique(np.concatenate(acc_d), return_inverse=True)
+        return u, np.bincount(inv, weights=np.concatenate(acc_b))
+
+    def _score(self, cand, q, post, idf):
+        """Точні бали BM25 для кандидатів: внески додаються в порядку термів запиту, як у BM25Okapi."""
+        norm = K1 * (1 - B + B * self._lens[cand] / self.avgdl)
+        scores = np.zeros(len(cand))
+        for t in q:
+            if t not in post:
+                continue
+            docs, tfs = post[t]
+            pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+            at = np.nonzero(docs[pos] == cand)[0]
+            tf = tfs[pos[at]].astype(np.float64)
+            scores[at] += idf[t] * (tf * (K1 + 1) / (tf + norm[at]))
+        return scores
+
+    def _pages(self, cand, scores):
+        """Бал сторінки — бал її найкращого уривка. -> (сторінки, бали, найкращі уривки) за зростанням сторінки."""
+        if not len(cand):
+            return cand, scores, cand
+        pg = self._pg[cand]
+        order = np.lexsort((-scores, pg))
+        pg, scores, cand = pg[order], scores[order], cand[order]
+        first = np.ones(len(pg), bool)
+        first[1:] = pg[1:] != pg[:-1]
+        return pg[first].astype(np.int64), scores[first], cand[first]
+
+    def _prepare(self, query: str, fuzzy: Optional[bool], proximity: Optional[bool]):
+        """Запит -> ключ кешу та аргументи _search: токени (після нечіткого розширення), ваги,
+        фрази, чи рахувати близькість; complete=False — результат не кешувати."""
+        fuzzy = FUZZY_SEARCH if fuzzy is None else fuzzy
+        proximity = (PROXIMITY_BOOST if proximity is None else proximity) and self.positions
+        q, phrases = tokenize(query), parse_phrases(query) if self.positions else ()
+        key = (tuple(q), fuzzy, phrases, proximity)
+        sq, weights, fixes, complete = self.expand(q) if fuzzy else (q, None, {}, True)
+        # слово фрази з одруківкою — найближчою заміною
+        phrases = tuple(tuple(fixes[t][0] if t in fixes else t for t in ph) for ph in phrases)
+        return key, (sq, weights, phrases, proximity), complete
+
+    @metrics.timed(SEARCH_SECONDS, kind="single")
+    def search(self, query: str, k: int = 6, fuzzy: Optional[bool] = None, proximity: Optional[bool] = None):
+        """Top-k сторінок за BM25 найкращого уривка; text — сніпет навколо збігів, highlights —
+        зсуви термів запиту в ньому. fuzzy (типово FUZZY_SEARCH) — розширювати невідомі слова
+        схожими зі словника; фрази в лапках мають стояти поспіль; proximity (типово
+        PROXIMITY_BOOST) — бонус уривкам, де терміни поруч. Фрази й близькість потребують
+        позицій в індексі (INDEX_POSITIONS). Результати кешуються в query_cache — словники не змінювати."""
+        if not query or not self.n or k <= 0:
             return []
-        scores = self.bm25.get_scores(tokenize(query))
-        top = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
-        res = []
-        for i in top:
-            m = self.meta[i].copy()
-            m["text"] = self.corpus[i][:400].replace("\n"," ")
-            m["score"] = float(scores[i])
+        key, args, complete = self._prepare(query, fuzzy, proximity)
+        key, generation = key + (k,), (self.generation, self._epoch)
+        res = query_cache.get(generation, key)
+        if res is None:
+            sq, weights, phrases, prox = args
+            res = self._search(sq, k, weights, phrases, prox)
+            if complete:
+                query_cache.put(generation, key, res)
+        return list(res)
+
+    def _search(self, q: List[str], k: int, weights: Optional[Dict[str, float]] = None,
+                phrases: tuple = (), proximity: bool = False):
+        qtf = Counter(q)
+        idf, post, ub = {}, {}, {}
+        for t in qtf:
+            tids = self.lookup(t)[1]
+            if not tids:
+                continue
+            idf[t] = self.idf(t) * weights[t] if weights and t in weights else self.idf(t)
+            post[t] = self._postings(tids)
+            bound = max(self._segs[si].term_bound(tid, self.avgdl) for si, tid in tids.items())
+            ub[t] = qtf[t] * idf[t] * bound
+            if proximity:   # терм бере участь щонайбільше у двох парах, кожна дає ≤ вага·min(idf)
+                ub[t] += qtf[t] * PROXIMITY_WEIGHT * max(idf[t], 0.0)
+
+        cand = np.empty(0, np.int64)
+        if phrases:
+            cand = self._phrase_docs(phrases, {t: v[0] for t, v in post.items()})
+        elif post:
+            cand = np.unique(np.concatenate([post[t][0] for t in self._essential(q, k, post, idf, ub)]))
+        scores = self._score(cand, q, post, idf)
+        if proximity and len(cand):
+            pd, boost = self._proximity(q, {t: v[0] for t, v in post.items()}, idf, cand)
+            scores[np.searchsorted(cand, pd)] += boost
+        pages, scores, best = self._pages(cand, scores)
+        return self._results(_top_k(pages, scores, k, self.n_pages), pages, best, q)
+
+    def _essential(self, q: List[str], k: int, post, idf, ub) -> set:
+        """MaxScore: точні бали сторінок найсильнішого терміна дають поріг top-k; терміни з
+        найменшими межами ub, що разом до нього не дотягують, не породжують кандидатів."""
+        essential = set(post)
+        lead = max(post, key=ub.get)
+        seed = post[lead][0]
+        s0 = ()
+        if len(seed) >= k and sum(len(post[t][0]) for t in post if t != lead) > 2 * len(seed):
+            s0 = self._pages(seed, self._score(seed, q, post, idf))[1]
+        if len(s0) >= k:
+            theta = np.partition(s0, len(s0) - k)[len(s0) - k]
+            rest = 0.0
+            for t in sorted(post, key=ub.get):
+                if theta <= 0 or rest + ub[t] >= theta * (1 - 1e-9):
+                    break
+                rest += ub[t]
+                essential.discard(t)
+        return essential
+
+    def _results(self, top, pages, best, q, spans: Optional[Dict] = None):
+        """Метадані й сніпети — лише для повернутих top-k сторінок. spans — спільний для пачки
+        запитів кеш {сторінка: (текст, token_spans)}, щоб не токенізувати сторінку двічі."""
+        terms, res = set(q), []
+        for gid, score in top:
+            si = int(np.searchsorted(self._pbase, gid, side="right")) - 1
+            seg, i = self._segs[si], gid - int(self._pbase[si])
+            j = int(np.searchsorted(pages, gid))
+            if j < len(pages) and pages[j] == gid:
+                p = int(best[j]) - int(self._base[si])
+            else:   # сторінка без збігів — її перший уривок
+                p = int(np.searchsorted(seg.psg_page, i))
+            page = spans.get(gid) if spans is not None else None
+            if page is None:
+                text = seg.text(i)
+                page = (text, token_spans(text))
+                if spans is not None:
+                    spans[gid] = page
+            m = seg.meta(i)
+            m["text"], m["highlights"] = make_snippet(page[0], int(seg.psg_start[p]), int(seg.psg_end[p]),
+                                                      terms, tokens=page[1])
+            m["score"] = score
             res.append(m)
         return res
 
-def build_index() -> LiteIndex:
-    texts, metas, tokenized = [], [], []
-    docs = [f for f in os.listdir("docs") if f.lower().endswith(".pdf")]
-    for name in docs:
-        path = os.path.join("docs", name)
+    @metrics.timed(SEARCH_SECONDS, kind="batch")
+    def search_many(self, queries: List[str], k: int = 6, fuzzy: Optional[bool] = None,
+                    proximity: Optional[bool] = None) -> List[List[Dict]]:
+        """search() для пачки запитів за один прохід; результати — у порядку queries."""
+        out: List[Optional[List[Dict]]] = [None] * len(queries)
+        generation, todo = (self.generation, self._epoch), {}
+        for i, query in enumerate(queries):
+            if not query or not self.n or k <= 0:
+                out[i] = []
+                continue
+            key, args, complete = self._prepare(query, fuzzy, proximity)
+            key += (k,)
+            res = query_cache.get(generation, key)
+            if res is None:
+                todo.setdefault(key, (args, complete, []))[2].append(i)
+            else:
+                out[i] = list(res)
+        if todo:
+            items = list(todo.items())
+            args = [a for _, (a, _, _) in items]
+            res_all = self._search_many([a[0] for a in args], k, [a[1] for a in args],
+                                        [a[2] for a in args], [a[3] for a in args])
+            for (key, (_, complete, where)), res in zip(items, res_all):
+                if complete:
+                    query_cache.put(generation, key, res)
+                for i in where:
+                    out[i] = list(res)
+        return out
+
+    def _search_many(self, queries: List[List[str]], k: int, weights: Optional[List[Dict[str, float]]] = None,
+                     phrases: Optional[List[tuple]] = None, proximity: Optional[List[bool]] = None):
+        # постинги кожного терміна і його внески (з вагою нечіткої заміни) рахуються один раз на пачку
+        weights = weights or [None] * len(queries)
+        phrases = phrases or [()] * len(queries)
+        proximity = proximity or [False] * len(queries)
+        post, bound, contrib = {}, {}, {}
+        for tw in {(t, w.get(t, 1.0) if w else 1.0) for q, w in zip(queries, weights) for t in q}:
+            t, wt = tw
+            if t not in post:
+                tids = self.lookup(t)[1]
+                if not tids:
+                    continue
+                post[t] = self._postings(tids)
+                bound[t] = max(self._segs[si].term_bound(tid, self.avgdl) for si, tid in tids.items())
+            docs, tfs = post[t]
+            tf = tfs.astype(np.float64)
+            norm = K1 * (1 - B + B * self._lens[docs] / self.avgdl)
+            idf = self.idf(t) * wt if wt != 1.0 else self.idf(t)
+            contrib[tw] = idf * (tf * (K1 + 1) / (tf + norm))
+        # внески пачки — розріджені трійки (запит, уривок, бал), що зводяться одним bincount;
+        # усередині запиту вони йдуть у порядку його термів, тож бали ті самі, що в search()
+        res, spans, block, keys, vals, cells = [], {}, [], [], [], 0
+        for qi, (q, wq, ph, prox) in enumerate(zip(queries, weights, phrases, proximity)):
+            tws = {t: (t, wq.get(t, 1.0) if wq else 1.0) for t in q}
+            qpost = {t: post[t] for t in tws if t in post}
+            idf = {t: self.idf(t) * tws[t][1] if tws[t][1] != 1.0 else self.idf(t) for t in qpost}
+            cand = None
+            if ph:
+                cand = self._phrase_docs(ph, {t: v[0] for t, v in qpost.items()})
+            elif qpost:
+                qtf = Counter(q)
+                ub = {t: qtf[t] * idf[t] * bound[t] for t in qpost}
+                if prox:
+                    ub = {t: u + qtf[t] * PROXIMITY_WEIGHT * max(idf[t], 0.0) for t, u in ub.items()}
+                essential = self._essential(q, k, qpost, idf, ub)
+                if len(essential) < len(qpost):
+                    cand = np.unique(np.concatenate([qpost[t][0] for t in essential]))
+            base = len(block) * self.n
+            for t in q:
+                if t not in qpost:
+                    continue
+                docs, w = qpost[t][0], contrib[tws[t]]
+                if cand is not None:
+                    at = np.minimum(np.searchsorted(cand, docs), max(len(cand) - 1, 0))
+                    hit = cand[at] == docs if len(cand) else np.zeros(len(docs), bool)
+                    docs, w = docs[hit], w[hit]
+                keys.append(docs + base)
+                vals.append(w)
+                cells += len(docs)
+            if prox and qpost:
+                pd, boost = self._proximity(q, {t: v[0] for t, v in qpost.items()}, idf, cand)
+                keys.append(pd + base)
+                vals.append(boost)
+            block.append(q)
+            if cells >= BATCH_BLOCK_CELLS or qi == len(queries) - 1:
+                res += self._flush_many(block, keys, vals, k, spans)
+                block, keys, vals, cells = [], [], [], 0
+        return res
+
+    def _flush_many(self, block, keys, vals, k, spans):
+        """Зводить трійки блоку запитів у бали уривків -> результати кожного запиту блоку."""
+        u, acc = np.empty(0, np.int64), np.empty(0)
+        if keys:
+            # ключі — відсортовані відрізки (по одному на терм), тож стабільне сортування (timsort)
+            # лише зливає їх; рівні ключі лишаються в порядку термів
+            u = np.concatenate(keys)
+            order = np.argsort(u, kind="stable")
+            u = u[order]
+            first = np.ones(len(u), bool)
+            first[1:] = u[1:] != u[:-1]
+            acc = np.bincount(np.cumsum(first) - 1, weights=np.concatenate(vals)[order])
+            u = u[first]
+        # як _pages(), але для всього блоку: ключ сторінки — (запит, сторінка)
+        qi = np.repeat(np.arange(len(block)), np.diff(np.searchsorted(u, np.arange(len(block) + 1) * self.n)))
+        docs = u - qi * self.n
+        pg = self._pg[docs].astype(np.int64) + qi * self.n_pages
+        order = np.lexsort((-acc, pg))
+        pg, acc, docs = pg[order], acc[order], docs[order]
+        first = np.ones(len(pg), bool)
+        first[1:] = pg[1:] != pg[:-1]
+        pg, acc, docs = pg[first], acc[first], docs[first]
+        bounds = np.searchsorted(pg, np.arange(len(block) + 1) * self.n_pages)
+        res = []
+        for qi, q in enumerate(block):
+            lo, hi = bounds[qi], bounds[qi + 1]
+            pages, best = pg[lo:hi] - qi * self.n_pages, docs[lo:hi]
+            res.append(self._results(_top_k(pages, acc[lo:hi], k, self.n_pages), pages, best, q, spans))
+        return res
+
+# Ціль для search_many: у стільки разів більше запитів/с, ніж цикл search()
+BATCH_TARGET_SPEEDUP = 2.0
+
+def batch_throughput(idx: LiteIndex, queries: List[str], k: int = 6, rounds: int = 3) -> Dict:
+    """queries/sec для циклу search() і для search_many() на тих самих запитах, без кешу результатів.
+    Обидва шляхи спершу прогріваються (кеш термінів, сторінки mmap), далі заміри чергуються
+    й береться найкращий з rounds."""
+    toks = [tokenize(q) for q in queries]
+    loop, batch = [idx._search(q, k) for q in toks], idx._search_many(toks, k)
+    t_loop = t_batch = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for q in toks:
+            idx._search(q, k)
+        t1 = time.perf_counter()
+        idx._search_many(toks, k)
+        t2 = time.perf_counter()
+        t_loop, t_batch = min(t_loop, t1 - t0), min(t_batch, t2 - t1)
+    loop_qps = len(queries) / max(t_loop, 1e-9)
+    batch_qps = len(queries) / max(t_batch, 1e-9)
+    return {"queries": len(queries), "loop_qps": round(loop_qps, 1), "batch_qps": round(batch_qps, 1),
+            "speedup": round(batch_qps / loop_qps, 2), "target": BATCH_TARGET_SPEEDUP,
+            "meets_target": batch_qps >= BATCH_TARGET_SPEEDUP * loop_qps, "identical": loop == batch}
+
+def make_snippet(text: str, start: int, end: int, terms, width: int = SNIPPET_CHARS, tokens=None):
+    """Фрагмент сторінки до width символів навколо уривка [start, end), з центром на найщільнішому
+    скупченні термів запиту. tokens — готовий token_spans(text).
+    -> (текст, [[початок, кінець], ...] підсвічених термів у ньому)."""
+    spans = [(a, b) for t, a, b in (token_spans(text) if tokens is None else tokens) if t in terms]
+    inside = [sp for sp in spans if start <= sp[0] < end]
+    if inside:
+        # вікно width з найбільшою кількістю збігів, центр — посередині між крайніми
+        best, lo = (0, 0), 0
+        for hi in range(len(inside)):
+            while inside[hi][1] - inside[lo][0] > width:
+                lo += 1
+            if hi - lo > best[1] - best[0]:
+                best = (lo, hi)
+        centre = (inside[best[0]][0] + inside[best[1]][1]) // 2
+        a = max(0, min(centre - width // 2, len(text) - width))
+    else:
+        a = start
+    b = min(len(text), a + width)
+    if a > 0:   # межі — по пробілах, щоб не різати слова
+        cut = text.find(" ", a, a + width // 4)
+        a = cut + 1 if cut >= 0 else a
+    if b < len(text):
+        cut = text.rfind(" ", b - width // 4, b)
+        b = cut if cut > a else b
+    prefix = "…" if a > 0 else ""
+    snippet = prefix + text[a:b].replace("\n", " ") + ("…" if b < len(text) else "")
+    shift = len(prefix) - a
+    return snippet, [[x + shift, y + shift] for x, y in spans if a <= x and y <= b]
+
+def _top_k(gids, scores, k: int, n: int):
+    """Те саме, що стабільне сортування всіх n документів за -score, але з частковим відбором."""
+    pos = scores > 0
+    g, s = gids[pos], scores[pos]
+    if len(s) > k:
+        keep = s >= np.partition(s, len(s) - k)[len(s) - k]
+        g, s = g[keep], s[keep]
+    out = [(int(g[i]), float(s[i])) for i in np.lexsort((g, -s))[:k]]
+    if len(out) < k:
+        # як у BM25Okapi: далі йдуть сторінки з нульовим балом у порядку корпусу
+        nonzero = set(gids[scores != 0].tolist())
+        gid = 0
+        while len(out) < k and gid < n:
+            if gid not in nonzero:
+                out.append((gid, 0.0))
+            gid += 1
+        neg = scores < 0
+        g, s = gids[neg], scores[neg]
+        out += [(int(g[i]), float(s[i])) for i in np.lexsort((g, -s))[:k - len(out)]]
+    return out
+
+def _average_idf(segments, n: int) -> float:
+    # той самий порядок сумування, що й у BM25Okapi: терміни в порядку першої появи
+    df = _vocab_df(segments)
+    if not df:
+        return 0.0
+    idf_sum = 0.0
+    for f in df.values():
+        idf_sum += math.log(n - f + 0.5) - math.log(f + 0.5)
+    return idf_sum / len(df)
+
+def _rss(field: str = "VmRSS") -> int:
+    """Поле /proc/self/status у байтах: VmRSS, пік VmHWM, RssAnon (купа) чи RssFile (mmap); 0 поза Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def _reset_peak_rss():
+    """Скидає VmHWM, щоб пік міряв саме цю збірку, а не все життя процесу."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _pdf_names() -> List[str]:
+    if not os.path.isdir(DOCS_DIR):
+        return []
+    return sorted(f for f in os.listdir(DOCS_DIR) if f.lower().endswith(".pdf"))
+
+# ---------- маніфест ----------
+MANIFEST_VERSION = 1
+
+def save_index(idx: LiteIndex):
+    data = {
+        "version": MANIFEST_VERSION,
+        "generation": idx.generation,
+        "avg_idf": idx.avg_idf,
+        "started": idx.started,
+        "segments": [{"name": s.name, "sha1": s.sha1, "mtime": s.mtime, "size": s.size}
+                     for s in idx.segments.values()],
+    }
+    _atomic_write(INDEX_PATH, json.dumps(data, ensure_ascii=False).encode())
+
+@metrics.timed(INDEX_SECONDS, op="load")
+def load_index(path: str = INDEX_PATH) -> LiteIndex:
+    """Відкриває індекс через mmap: читаються лише маніфест і заголовки сегментів."""
+    with open(path, "rb") as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"unsupported index version {data.get('version')}")
+    segments = {}
+    for s in data["segments"]:
         try:
-            for page, txt in pdf_to_pages(path):
-                toks = tokenize(txt)
-                if not toks: continue
-                texts.append(txt)
-                tokenized.append(toks)
-                metas.append({"doc_id": os.path.splitext(name)[0], "page": page, "source_path": path})
+            segments[s["name"]] = Segment.open(_segment_path(s["sha1"]), s["name"], s["sha1"], s["mtime"], s["size"])
         except Exception as e:
-            print(f"[warn] failed {name}: {e}")
-    bm25 = BM25Okapi(tokenized if tokenized else [[]])
-    idx = LiteIndex(texts, metas, bm25)
-    os.makedirs("store", exist_ok=True)
-    with open(INDEX_PATH, "wb") as f:
-        pickle.dump(idx, f)
+            print(f"[warn] segment {s['name']}: {e}")
+    # без якогось сегмента середній idf уже інший — хай перерахується
+    avg_idf = data.get("avg_idf") if len(segments) == len(data["segments"]) else None
+    return LiteIndex(segments, data["generation"], avg_idf, data.get("started", 0.0))
+
+class _LegacyObject:
+    pass
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Пускає лише класи старих індексів — довільний код зі store/ не виконується."""
+    ALLOWED = {
+        ("retriever_lite", "LiteIndex"): _LegacyObject,
+        ("retriever_lite", "Segment"): _LegacyObject,
+        ("rank_bm25", "BM25Okapi"): _LegacyObject,
+        ("collections", "Counter"): dict,
+    }
+
+    def find_class(self, module, name):
+        if (module, name) in self.ALLOWED:
+            return self.ALLOWED[(module, name)]
+        raise pickle.UnpicklingError(f"forbidden class {module}.{name}")
+
+@metrics.timed(INDEX_SECONDS, op="convert")
+def convert_legacy_index(path: str = LEGACY_INDEX_PATH) -> LiteIndex:
+    """Переводить старий store/lite_index.pkl у сегменти без повторного читання PDF."""
+    with open(path, "rb") as f:
+        old = _LegacyUnpickler(f).load()
+    by_doc: Dict[str, list] = {}
+    if hasattr(old, "segments"):   # сегментований pickle
+        for name, s in old.segments.items():
+            by_doc[name] = [(m["page"], t) for m, t in zip(s.meta, s.texts)]
+    else:                          # один BM25Okapi на весь корпус
+        for m, t in zip(old.meta, old.corpus):
+            by_doc.setdefault(os.path.basename(m["source_path"]), []).append((m["page"], t))
+    segments = {}
+    for name in sorted(by_doc):
+        pdf = os.path.join(DOCS_DIR, name)
+        if not os.path.exists(pdf):
+            continue
+        b = SegmentBuilder()
+        for page, text in by_doc[name]:   # старі частоти рахувались по цілих сторінках
+            b.add_text(page, text)
+        segments[name] = write_segment(name, file_sha1(pdf), b)
+    idx = LiteIndex(segments, 1)
+    _publish(idx)
+    schedule_compact(idx)
+    os.remove(path)
+    print(f"[index] converted {path}: {len(segments)} segments, {len(idx)} pages", flush=True)
     return idx
 
-_cached = None
-def ensure_index(rebuild: bool = False) -> LiteIndex:
-    global _cached
-    if rebuild or _cached is None:
-        if rebuild or not os.path.exists(INDEX_PATH):
-            _cached = build_index()
+# ---------- знімок індексу ----------
+# Сегменти, зібрані заздалегідь (snapshot.py під час docker build або перед деплоєм), з маніфестом
+# snapshot.json. Знімок не підміняє store/: перед збіркою індексу його сегменти докопіюються туди,
+# і build_index бере їх за sha1 PDF, як будь-який кеш сегментів, — PDF, яких у знімку нема або які
+# змінились, читаються як завжди.
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_MANIFEST = "snapshot.json"
+SNAPSHOT_VERSION = 1
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def read_snapshot(root: str) -> Optional[Dict]:
+    """Маніфест знімка; None — знімка нема або він зібраний іншим форматом чи вікном уривків."""
+    try:
+        with open(os.path.join(root, SNAPSHOT_MANIFEST), "rb") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    if (data.get("version") != SNAPSHOT_VERSION or data.get("seg_version") != SEG_VERSION
+            or tuple(data.get("window", ())) != (PASSAGE_TOKENS, PASSAGE_STRIDE)
+            or (INDEX_POSITIONS and not data.get("positions"))):
+        print(f"[warn] snapshot {root} does not match this build, ignored")
+        return None
+    return data
+
+def _segment_ok(path: str) -> bool:
+    try:
+        return not Segment.open(path, "", "").stale()
+    except (OSError, ValueError):
+        return False
+
+def seed_from_snapshot(root: Optional[str] = None) -> int:
+    """Докопійовує в SEGMENTS_DIR сегменти знімка для PDF з docs/, яких там нема або які застаріли.
+    Копія перевіряється за sha256 з маніфесту. -> скільки сегментів скопійовано."""
+    root = INDEX_SNAPSHOT_DIR if root is None else root
+    if not root or not os.path.isdir(root):
+        return 0
+    try:
+        data = read_snapshot(root)
+    except Exception as e:
+        print(f"[warn] snapshot {root}: {e}")
+        return 0
+    if data is None:
+        return 0
+    names, seeded = set(_pdf_names()), 0
+    for s in data["segments"]:
+        dst = _segment_path(s["sha1"])
+        if s["name"] not in names or _segment_ok(dst):
+            continue
+        # та сама схема імені, що в _atomic_write: залишки перерваної копії прибере _sweep_tmp
+        src = os.path.join(root, "segments", f"{s['sha1']}.seg")
+        tmp = f"{dst}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.makedirs(SEGMENTS_DIR, exist_ok=True)
+            h = hashlib.sha256()
+            with open(src, "rb") as fi, open(tmp, "wb") as fo:
+                for chunk in iter(lambda: fi.read(1 << 20), b""):
+                    h.update(chunk)
+                    fo.write(chunk)
+                fo.flush()
+                os.fsync(fo.fileno())
+            if h.hexdigest() != s["sha256"]:
+                raise ValueError("checksum mismatch")
+            os.replace(tmp, dst)
+            seeded += 1
+        except Exception as e:
+            print(f"[warn] snapshot segment {s['name']}: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    if seeded:
+        _fsync_dir(SEGMENTS_DIR)
+        print(f"[index] seeded {seeded} segments from snapshot {root}", flush=True)
+    return seeded
+
+@metrics.timed(INDEX_SECONDS, op="build")
+def build_index(prev: Optional[LiteIndex] = None, workers: Optional[int] = None) -> LiteIndex:
+    """Синхронізує індекс з docs/: перечитуються лише нові або змінені PDF."""
+    _reset_peak_rss()
+    started = time.time()
+    old = prev.segments if prev else {}
+    segments, jobs = {}, []
+    for name in _pdf_names():
+        try:
+            seg, sha1 = _reuse_segment(name, old.get(name))
+        except Exception as e:
+            print(f"[warn] failed {name}: {e}")
+            continue
+        if seg:
+            segments[name] = seg
         else:
+            jobs.append((name, sha1))
+    segments.update(extract_segments(jobs, workers))
+    segments = {name: segments[name] for name in sorted(segments)}
+    idx = LiteIndex(segments, (prev.generation + 1) if prev else 1, started=started)
+    last_build_stats.update(peak_rss_mb=round(_rss("VmHWM") / 2**20, 1), rss_mb=round(_rss() / 2**20, 1),
+                            index_mb=round(sum(s.nbytes for s in segments.values()) / 2**20, 2),
+                            positions_mb=round(sum(s.positions_nbytes() for s in segments.values()) / 2**20, 2))
+    _publish(idx)
+    schedule_compact(idx)
+    return idx
+
+def compact(idx: LiteIndex):
+    """Фонове злиття: зводить глобальну статистику в маніфест і прибирає осиротілі сегменти.
+    Лише поки idx — останнє покоління: новіше могло вже дописати сегменти, яких idx не знає."""
+    idx.stats()
+    with _writer_lock():
+        try:
             with open(INDEX_PATH, "rb") as f:
-                _cached = pickle.load(f)
+                current = json.load(f).get("generation")
+        except Exception:
+            current = None
+        if current != idx.generation:
+            return
+        _publish(idx, warm=False)
+        live = {f"{s.sha1}.seg" for s in idx.segments.values()}
+        if os.path.isdir(SEGMENTS_DIR):
+            for f in os.listdir(SEGMENTS_DIR):
+                if f.endswith((".seg", ".pkl")) and f not in live:
+                    try:
+                        os.remove(os.path.join(SEGMENTS_DIR, f))
+                    except OSError:
+                        pass
+        for folder in {os.path.dirname(INDEX_PATH) or ".", SEGMENTS_DIR}:
+            _sweep_tmp(folder)
+
+_TMP = re.compile(r"\.tmp(\d+)\.\d+$")
+TMP_MAX_AGE = 3600
+
+def _sweep_tmp(folder: str):
+    """Недописані тимчасові файли _atomic_write (процес чи daemon-потік убили посеред запису):
+    геть, якщо процесу-автора вже нема або файлу більше за TMP_MAX_AGE секунд."""
+    if not os.path.isdir(folder):
+        return
+    for f in os.listdir(folder):
+        m = _TMP.search(f)
+        if not m:
+            continue
+        path = os.path.join(folder, f)
+        try:
+            stale = time.time() - os.stat(path).st_mtime > TMP_MAX_AGE
+            pid = int(m.group(1))
+            if not stale and pid != os.getpid() and fcntl is not None:   # kill(pid, 0) — лише POSIX
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    stale = True
+                except PermissionError:     # чужий, але живий процес
+                    pass
+            if stale:
+                os.remove(path)
+        except OSError:
+            pass
+
+def schedule_compact(idx: LiteIndex):
+    threading.Thread(target=compact, args=(idx,), daemon=True).start()
+
+# ---------- кілька процесів над одним store/ ----------
+# Кожен воркер API відкриває ті самі .seg через mmap — сторінки спільні в кеші ОС.
+# Писати індекс може лише власник INDEX_LOCK_PATH; новий маніфест і є сигналом перезавантаження:
+# решта процесів підхоплює його не частіше, ніж раз на INDEX_RELOAD_CHECK секунд. Старий LiteIndex
+# лишається живим, доки його тримають запити в роботі, тож перехід на нове покоління нічого не рве.
+INDEX_LOCK_PATH = "store/index.lock"
+INDEX_RELOAD_CHECK = float(os.getenv("INDEX_RELOAD_CHECK", "1"))
+
+_write_lock = threading.RLock()
+_write_depth = 0
+
+@contextmanager
+def _writer_lock():
+    global _write_depth
+    with _write_lock:
+        if _write_depth or fcntl is None:
+            _write_depth += 1
+            try:
+                yield
+            finally:
+                _write_depth -= 1
+            return
+        os.makedirs(os.path.dirname(INDEX_LOCK_PATH) or ".", exist_ok=True)
+        with open(INDEX_LOCK_PATH, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _write_depth += 1
+            try:
+                yield
+            finally:
+                _write_depth -= 1
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _manifest_key():
+    try:
+        st = os.stat(INDEX_PATH)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+_cached = None
+_cached_key = None
+_checked = 0.0
+_swap_lock = threading.Lock()    # лише на заміну посилання на покоління, не на збірку
+
+def _swap(idx: LiteIndex, key) -> bool:
+    """RCU-публікація в процесі: _cached просто перенаправляється на нове покоління. Запити в
+    роботі дочитують той LiteIndex, який уже взяли; старіше покоління поточним не стає."""
+    global _cached, _cached_key
+    with _swap_lock:
+        if _cached is None or idx.generation > _cached.generation:
+            _cached, _cached_key = idx, key
+            return True
+        if idx is _cached:       # те саме покоління переписав compact — новий лише ключ маніфесту
+            _cached_key = key
+        return False
+
+_loader: Optional[threading.Thread] = None
+
+def _publish(idx: LiteIndex, warm: bool = True) -> LiteIndex:
+    """Пише маніфест і робить idx поточним у цьому процесі. Нове покоління спершу прогрівається:
+    читачі отримують його вже готовим, а зведений avg_idf потрапляє в маніфест для інших процесів."""
+    if warm:
+        idx.warm()
+    save_index(idx)
+    if _swap(idx, _manifest_key()) and FUZZY_SEARCH:
+        idx.fuzzy_index()     # без прогріву триграми будуються у фоні разом із новим поколінням
+    return idx
+
+def _reload(force: bool = False, background: bool = False) -> Optional[LiteIndex]:
+    """Підхоплює новіше покоління, записане іншим процесом. background — відкрити й прогріти його
+    у фоновому потоці, а поки що віддавати поточне: читач ніколи не платить за перехід."""
+    global _checked
+    now = time.monotonic()
+    if not force and now - _checked < INDEX_RELOAD_CHECK:
+        return _cached
+    _checked = now
+    if _cached is None or not background:
+        return _load_latest(warm=False)
+    if _manifest_key() not in (None, _cached_key):
+        _reload_in_background()
+    return _cached
+
+def _reload_in_background():
+    global _loader
+    with _swap_lock:
+        if _loader is not None and _loader.is_alive():
+            return
+        _loader = threading.Thread(target=_load_latest, args=(True,), name="index-reload", daemon=True)
+        _loader.start()
+
+def _load_latest(warm: bool) -> Optional[LiteIndex]:
+    """Без блокувань: маніфест і сегменти пишуться через rename, а якщо маніфест замінили посеред
+    читання (і compact міг прибрати сегменти старого) — читаємо ще раз."""
+    global _cached_key
+    for _ in range(3):
+        key = _manifest_key()
+        if key is None or key == _cached_key:
+            return _cached
+        try:
+            idx = load_index()
+        except Exception as e:   # маніфест битий — спробуємо наступного разу
+            print(f"[warn] index reload: {e}")
+            return _cached
+        if _manifest_key() == key:
+            break
+    if warm and (_cached is None or idx.generation > _cached.generation):
+        try:
+            idx.warm()
+        except Exception as e:
+            print(f"[warn] index warm-up: {e}")
+    if _swap(idx, key):
+        if FUZZY_SEARCH:
+            idx.fuzzy_index()
+        print(f"[index] reloaded generation {idx.generation} ({len(idx)} pages)", flush=True)
+    else:
+        with _swap_lock:
+            _cached_key = key
     return _cached
+
+def _out_of_sync(idx: LiteIndex) -> bool:
+    # сегменти старого формату не відкрились, змінилось вікно уривків або PDF змінились, поки процес лежав
+    return (set(idx.segments) != set(_pdf_names())
+            or any(s.stale() and not s.failed for s in idx.segments.values()))
+
+def _sync(rebuild: bool) -> LiteIndex:
+    """Збірка під writer lock. rebuild — синхронізувати з docs/ навіть без видимих змін."""
+    requested = time.time()
+    with _writer_lock():
+        # поки чекали на lock, індекс міг зібрати інший воркер — після нашого запиту, тож він годиться
+        idx = _reload(force=True)
+        if idx is not None:
+            if idx.started >= requested:
+                return idx
+            rebuild = rebuild or _out_of_sync(idx)
+        elif os.path.exists(LEGACY_INDEX_PATH):
+            try:
+                idx = convert_legacy_index()
+            except Exception as e:
+                print(f"[warn] legacy index {LEGACY_INDEX_PATH}: {e}")
+        if rebuild or idx is None:
+            seed_from_snapshot()
+            idx = build_index(idx)
+        return idx
+
+# single-flight: конкурентні запити на збірку зливаються. Хто прийшов, поки збірка йде, чекає на
+# наступну — одну на всіх, бо поточна могла вже пропустити їхні зміни в docs/.
+_flight = threading.Condition()
+_flight_state = {"started": 0, "done": 0, "rebuild": False, "result": None, "error": None}
+REBUILDS = metrics.counter("index_rebuild_requests_total", "ensure_index rebuild requests", ("result",))
+
+def _single_flight(rebuild: bool) -> LiteIndex:
+    st = _flight_state
+    with _flight:
+        ticket = st["started"] + 1        # збірка, що почнеться не раніше за цей виклик
+        st["rebuild"] = st["rebuild"] or rebuild
+        while st["done"] < ticket and st["started"] > st["done"]:
+            _flight.wait()
+        if st["done"] >= ticket:          # її вже зібрав інший потік
+            REBUILDS.inc(result="shared")
+            if st["error"] is not None:
+                raise st["error"]
+            return st["result"]
+        st["started"] += 1
+        mine, flag, st["rebuild"] = st["started"], st["rebuild"], False
+    REBUILDS.inc(result="built")
+    res = err = None
+    try:
+        res = _sync(flag)
+        return res
+    except Exception as e:
+        err = e
+        raise
+    finally:
+        with _flight:
+            st["done"], st["result"], st["error"] = mine, res, err
+            _flight.notify_all()
+
+def _sync_in_background():
+    try:
+        _single_flight(False)
+    except Exception as e:
+        print(f"[warn] background index sync: {e}", flush=True)
+
+def ensure_index(rebuild: bool = False) -> LiteIndex:
+    """Поточне покоління. Читачі на збірку не чекають: є що віддати — віддаємо, а якщо docs/ розійшлись
+    з індексом, той синхронізується у фоні. Чекає лише перший запуск без індексу на диску.
+    rebuild=True — дочекатися збірки, що почалась після виклику (одна на всі конкурентні)."""
+    if not rebuild:
+        if _cached is not None:
+            return _reload(background=True)
+        idx = _reload(force=True)
+        if idx is not None and (idx.segments or not _pdf_names()):
+            if _out_of_sync(idx):
+                threading.Thread(target=_sync_in_background, name="index-sync", daemon=True).start()
+            return idx
+    return _single_flight(rebuild)
+
+def current_index() -> Optional[LiteIndex]:
+    """Поточне покоління без збірки: None, якщо індекс ще не відкривали й на диску його нема."""
+    return _reload(force=True) if _cached is None else _reload(background=True)
+
+def reload_index() -> LiteIndex:
+    """Сигнал перезавантаження: синхронізувати індекс з docs/ і опублікувати нове покоління —
+    інші воркери перейдуть на нього при наступній перевірці маніфесту."""
+    return ensure_index(rebuild=True)
+
+def _apply(segments: Dict[str, Segment]) -> LiteIndex:
+    prev = _cached
+    idx = LiteIndex(dict(sorted(segments.items())), prev.generation + 1, started=prev.started)
+    _publish(idx)
+    schedule_compact(idx)
+    return idx
+
+@metrics.timed(INDEX_SECONDS, op="add")
+def index_document(name: str) -> LiteIndex:
+    """Додає або оновлює один PDF з docs/ — решта сегментів не чіпається."""
+    ensure_index()   # перше відкриття — до writer lock: single-flight не має чекати сам на себе
+    with _writer_lock():
+        prev = _reload(force=True)
+        segments = dict(prev.segments)
+        segments[name] = load_segment(name, segments.get(name))
+        return _apply(segments)
+
+@metrics.timed(INDEX_SECONDS, op="remove")
+def remove_document(name: str) -> LiteIndex:
+    ensure_index()   # перше відкриття — до writer lock: single-flight не має чекати сам на себе
+    with _writer_lock():
+        prev = _reload(force=True)
+        segments = {k: v for k, v in prev.segments.items() if k != name}
+        return _apply(segments)
@@ -1,8 +1,12 @@
 import os
 import sys
+import json
+import time
 import shutil
 import asyncio
 import signal
+import urllib.parse
+import urllib.request
 
 # ---------- диски та симлінки ----------
 def ensure_disk_links():
@@ -48,18 +52,69 @@ async def start(cmd, name):
     asyncio.create_task(pipe(proc.stderr, sys.stderr))
     return proc
 
+# ---------- індекс ----------
+def request_reload(port: int):
+    """SIGHUP -> POST /index/reload: один воркер публікує нове покоління, решта підхоплюють його з маніфесту."""
+    try:
+        req = urllib.request.Request(f"http://127.0.0.1:{port}/index/reload", method="POST",
+                                     headers={"X-Admin-Token": os.environ.get("ADMIN_TOKEN", "")})
+        with urllib.request.urlopen(req, timeout=600) as r:
+            print(f"[runner] index reloaded: {r.read().decode()}", flush=True)
+    except Exception as e:
+        print(f"[warn] index reload: {e}", file=sys.stderr)
+
+WARMUP_QUERY = os.environ.get("WARMUP_QUERY", "звіт")
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "600"))
+
+def warm_up(port: int, boot: float):
+    """Чекає, поки API відкриє й прогріє індекс (/health -> index=ready), і робить пробний пошук —
+    запит користувача після холодного старту вже не перший. Друкує time-to-first-query від запуску
+    runner. З кількома воркерами проба потрапляє в один із них; решта прогріваються самі."""
+    base = f"http://127.0.0.1:{port}"
+    while time.monotonic() - boot < WARMUP_TIMEOUT:
+        try:
+            with urllib.request.urlopen(f"{base}/health", timeout=5) as r:
+                if json.load(r).get("index") == "ready":
+                    break
+        except Exception:
+            pass
+        time.sleep(0.5)
+    else:
+        print(f"[warn] index not ready after {WARMUP_TIMEOUT:.0f}s", file=sys.stderr)
+        return
+    ready = time.monotonic() - boot
+    try:
+        q = urllib.parse.urlencode({"q": WARMUP_QUERY, "k": 1})
+        with urllib.request.urlopen(f"{base}/search?{q}", timeout=30) as r:
+            r.read()
+    except Exception as e:
+        print(f"[warn] warm-up query: {e}", file=sys.stderr)
+        return
+    print(f"[runner] index ready in {ready:.2f}s, first query answered in {time.monotonic() - boot:.2f}s "
+          f"after boot", flush=True)
+
 # ---------- main ----------
 async def main():
+    boot = time.monotonic()
     ensure_disk_links()
 
     port = int(os.environ.get("PORT", "8000"))
-    print(f"[runner] launching api on port {port}", flush=True)
+    # воркери API ділять один індекс: сегменти відкриваються через mmap зі спільного store/
+    workers = max(1, int(os.environ.get("API_WORKERS", "1")))
+    # у режимі webhook бот живе в процесі API, а його стан (сторінки пошуку, черга завантажень,
+    # порядок апдейтів чату) — у пам'яті: апдейти одного чату, розкидані по воркерах, його губили б
+    if os.environ.get("WEBHOOK_URL") and workers > 1:
+        print("[runner] ERROR: WEBHOOK_URL requires API_WORKERS=1 (bot state is per process); "
+              "unset WEBHOOK_URL to run the bot with long polling next to several API workers", file=sys.stderr)
+        raise SystemExit(2)
+    print(f"[runner] launching api on port {port} ({workers} workers)", flush=True)
 
     # API
-    _api = await start(
-        ["python", "-m", "uvicorn", "server:app", "--host", "0.0.0.0", "--port", str(port)],
-        "api",
-    )
+    cmd = ["python", "-m", "uvicorn", "server:app", "--host", "0.0.0.0", "--port", str(port)]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    _api = await start(cmd, "api")
+    asyncio.get_event_loop().run_in_executor(None, warm_up, port, boot)
 
     # Бот з автоперезапуском
     async def run_bot_forever():
@@ -72,7 +127,10 @@ async def main():
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 60)
 
-    bot_task = asyncio.create_task(run_bot_forever())
+    if os.environ.get("WEBHOOK_URL"):
+        print("[runner] bot runs in webhook mode inside the api", flush=True)
+    else:
+        bot_task = asyncio.create_task(run_bot_forever())
 
     # коректне завершення
     stop = asyncio.Event()
@@ -85,6 +143,11 @@ async def main():
             asyncio.get_event_loop().add_signal_handler(s, handle_sig)
         except NotImplementedError:
             pass
+    try:
+        asyncio.get_event_loop().add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.get_event_loop().run_in_executor(None, request_reload, port))
+    except (AttributeError, NotImplementedError):   # на Windows SIGHUP нема
+        pass
 
     await stop.wait()
 
@@ -1,42 +1,448 @@
 import os
-from fastapi import FastAPI, UploadFile, File
+import hmac
+import time
+import asyncio
+import httpx
+from typing import Dict, List, Optional
+from collections import Counter
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartException, MultiPartParser
+from pydantic import BaseModel
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import retriever_lite
+import docs_store
+import page_cache
+import metrics
 
 # Гарантуємо каталоги
 os.makedirs("docs", exist_ok=True)
 os.makedirs("store", exist_ok=True)
 
 app = FastAPI(title="PromoDocs API (Lite)")
+app.add_middleware(metrics.ASGIMetrics)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
 )
 
-# Роздача PDF
-app.mount("/files", StaticFiles(directory="docs", check_dir=False), name="files")
+# ---------- холодний старт ----------
+def _process_start() -> float:
+    """Момент запуску процесу (time.time()) з /proc — щоб врахувати й імпорти; інакше — імпорт server."""
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])   # поле 22, starttime
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+PROCESS_START = _process_start()
+startup: Dict[str, float] = {}     # етап -> секунд від запуску процесу
+metrics.gauge("startup_seconds", "Seconds from process start to index_ready / first_query", lambda: dict(startup),
+              ("stage",))
+
+def _mark(stage: str):
+    if stage not in startup:
+        startup[stage] = round(time.time() - PROCESS_START, 3)
+        print(f"[startup] {stage} in {startup[stage]:.2f}s after process start", flush=True)
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "index": "ready" if "index_ready" in startup else "warming"}
+
+# ---------- Telegram webhook ----------
+# З WEBHOOK_URL бот працює тут же, в процесі API; без нього run_all.py запускає polling.
+# Стан бота (user_data для сторінок пошуку, дебаунс inline, черга завантажень, порядок апдейтів
+# чату) — у пам'яті процесу, тож webhook можливий лише з одним воркером: run_all.py відмовляється
+# стартувати з WEBHOOK_URL і API_WORKERS>1, а другий процес, що спробує підняти бота, не стартує
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LOCK_PATH = "store/telegram_webhook.lock"
+tg_app = None
+_webhook_lock = None
+
+def _hold_webhook_lock():
+    global _webhook_lock
+    if fcntl is None:
+        return
+    f = open(WEBHOOK_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        raise RuntimeError("telegram webhook already runs in another API process; "
+                           "WEBHOOK_URL needs a single worker (API_WORKERS=1)")
+    _webhook_lock = f      # тримаємо до кінця процесу
+
+@app.on_event("startup")
+async def start_bot():
+    global tg_app
+    if not WEBHOOK_URL or not os.getenv("TELEGRAM_BOT_TOKEN"):
+        return
+    _hold_webhook_lock()
+    import bot_telegram
+    bot_app = bot_telegram.build_application(webhook=True)
+    try:
+        await bot_telegram.start_webhook(bot_app)
+    except Exception as e:   # API лишається живим; Telegram повторить апдейти, коли бот підніметься
+        print(f"[warn] telegram webhook: {e}", flush=True)
+        return
+    tg_app = bot_app
+
+@app.on_event("shutdown")
+async def stop_bot():
+    global tg_app
+    if tg_app is not None:
+        import bot_telegram
+        bot_app, tg_app = tg_app, None
+        await bot_telegram.stop_webhook(bot_app)
+
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+    if tg_app is None:
+        return JSONResponse({"error": "bot is not running in webhook mode"}, status_code=503)
+    import bot_telegram
+    token = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not hmac.compare_digest(token, bot_telegram.WEBHOOK_SECRET):
+        return JSONResponse({"error": "bad secret token"}, status_code=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "bad update"}, status_code=400)
+    await bot_telegram.feed_update(tg_app, data)
+    return Response(status_code=200)
+
+# ---------- метрики ----------
+# Бот — окремий процес зі своїм портом метрик; його числа дописуються сюди ж
+BOT_METRICS_URL = os.getenv("BOT_METRICS_URL", "http://127.0.0.1:9101/metrics")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    body = metrics.render()
+    if BOT_METRICS_URL and tg_app is None:
+        up = 0
+        try:
+            async with httpx.AsyncClient(timeout=0.5) as client:
+                r = await client.get(BOT_METRICS_URL)
+            r.raise_for_status()
+            body += r.text
+            up = 1
+        except Exception:
+            pass
+        body += f"# HELP bot_metrics_up Bot metrics endpoint reachable\n# TYPE bot_metrics_up gauge\nbot_metrics_up {up}\n"
+    return Response(body, media_type=metrics.CONTENT_TYPE)
 
 @app.get("/files-list")
-def files_list():
-    files = []
-    if os.path.isdir("docs"):
-        for name in sorted(os.listdir("docs")):
-            if name.lower().endswith(".pdf"):
-                files.append({"name": name, "url": f"/files/{name}"})
-    return {"files": files}
+def files_list(request: Request):
+    snap = docs_store.catalog.snapshot()
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if docs_store.etag_matches(request.headers.get("if-none-match"), snap.etag):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(snap.body_gz, media_type="application/json", headers=headers)
+    return Response(snap.body, media_type="application/json", headers=headers)
+
+# Роздача PDF: ETag/304 і Range, щоб переглядач міг тягнути файл частинами
+@app.api_route("/files/{name}", methods=["GET", "HEAD"])
+def files(name: str, request: Request):
+    m = docs_store.catalog.entry(name)
+    if m is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    etag, size = f'"{m["sha1"]}"', m["size"]
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "no-cache",
+               "Last-Modified": formatdate(m["mtime"], usegmt=True)}
+    if docs_store.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    start, end, status = 0, size - 1, 200
+    rng = request.headers.get("range")
+    if rng and request.headers.get("if-range", etag) == etag:
+        r = docs_store.parse_range(rng, size)
+        if r is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if r:
+            (start, end), status = r, 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type="application/pdf")
+    path = os.path.join(docs_store.DOCS_DIR, name)
+    return StreamingResponse(docs_store.iter_file(path, start, end), status_code=status,
+                             headers=headers, media_type="application/pdf")
+
+# Окремі сторінки: мобільні переглядачі ігнорують #page=N і качають весь PDF
+@app.get("/pages/{name}")
+def page_extract(name: str, request: Request, p: str = Query(..., min_length=1),
+                 format: str = Query("pdf"), dpi: int = Query(page_cache.DPI_DEFAULT)):
+    try:
+        res = page_cache.get_pages(name, p, format, dpi)
+    except page_cache.DocumentError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    except page_cache.PageError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if res is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    path, etag = res
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if docs_store.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    stem = os.path.splitext(name)[0]
+    suffix = f"p{p}.png" if format == "png" else f"p{p}.pdf"
+    media = "image/png" if format == "png" else "application/pdf"
+    return FileResponse(path, media_type=media, headers=headers,
+                        filename=f"{stem}_{suffix}", content_disposition_type="inline")
+
+UPLOAD_OVERHEAD = 64 * 1024     # заголовки multipart понад сам файл
+
+async def _limited(stream, limit: int, state: Dict):
+    """Тіло запиту, але не більше limit байтів: далі — обрив розбору, решта не докачується."""
+    total = 0
+    async for chunk in stream:
+        total += len(chunk)
+        if total > limit:
+            state["too_large"] = True
+            raise MultiPartException("request body too large")
+        yield chunk
 
 @app.post("/upload")
-async def upload(file: UploadFile = File(...)):
+async def upload(request: Request):
+    # ліміт — до розбору multipart: інакше Starlette спершу прийняв би й поклав на диск усе тіло
+    limit = docs_store.MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD
+    too_large = JSONResponse({"error": f"file is larger than {docs_store.MAX_UPLOAD_BYTES // (1024 * 1024)} MB"},
+                             status_code=413)
+    try:
+        if int(request.headers.get("content-length") or 0) > limit:
+            return too_large
+    except ValueError:
+        return JSONResponse({"error": "bad Content-Length"}, status_code=400)
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return JSONResponse({"error": "multipart/form-data expected"}, status_code=400)
+    state: Dict = {}
+    try:
+        form = await MultiPartParser(request.headers, _limited(request.stream(), limit, state),
+                                     max_files=1, max_fields=10).parse()
+    except MultiPartException as e:
+        return too_large if state else JSONResponse({"error": str(e)}, status_code=400)
     try:
-        path = os.path.join("docs", file.filename)
-        with open(path, "wb") as f:
-            f.write(await file.read())
-        return {"message": f"{file.filename} uploaded"}
+        file = form.get("file")
+        if file is None or isinstance(file, str):
+            return JSONResponse({"error": "file field is required"}, status_code=400)
+        name = docs_store.safe_name(file.filename)
+        if not name:
+            return JSONResponse({"error": "bad file name"}, status_code=400)
+        try:
+            await run_in_threadpool(docs_store.save_stream, file.file, name)
+        except docs_store.UploadTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        await form.close()
+    res = {"message": f"{name} uploaded"}
+    if name.lower().endswith(".pdf"):
+        res["ingest"] = enqueue_ingest(name)
+    return res
+
+# ---------- фонова індексація нових документів ----------
+# Одна черга й один потік: документи індексуються по черзі, пошук тим часом
+# працює на попередньому поколінні індексу
+_ingest_pool = ThreadPoolExecutor(1, thread_name_prefix="ingest")
+_ingest_queue: Optional[asyncio.Queue] = None
+_ingest_worker: Optional[asyncio.Task] = None
+ingest_jobs: Dict[str, Dict] = {}
+
+def enqueue_ingest(name: str) -> Dict:
+    global _ingest_queue, _ingest_worker
+    if _ingest_queue is None:
+        _ingest_queue = asyncio.Queue()
+    job = ingest_jobs.get(name)
+    if job and job["state"] == "queued":
+        return job
+    job = ingest_jobs[name] = {"name": name, "state": "queued", "queued_at": time.time()}
+    _ingest_queue.put_nowait(name)
+    if _ingest_worker is None or _ingest_worker.done():
+        _ingest_worker = asyncio.create_task(_ingest_loop())
+    return job
+
+async def _ingest_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        name = await _ingest_queue.get()
+        job = ingest_jobs[name]
+        job.update(state="indexing", started_at=time.time())
+        try:
+            idx = await loop.run_in_executor(_ingest_pool, retriever_lite.index_document, name)
+            seg = idx.segments.get(name)
+            if seg is None or seg.failed:   # битий PDF теж дає сегмент, але з прапорцем failed
+                job.update(state="failed", error="could not read PDF", failed_at=time.time(),
+                           generation=idx.generation, pages=seg.n_pages if seg else 0)
+                continue
+            job.update(state="searchable", searchable_at=time.time(), generation=idx.generation,
+                       pages=seg.n_pages)
+        except Exception as e:
+            job.update(state="failed", error=str(e), failed_at=time.time())
+
+# /ingest і /index/reload запускають індексацію в кожному воркері — лише з ADMIN_TOKEN у заголовку
+# X-Admin-Token (його ж шлють бот і run_all); без ADMIN_TOKEN в оточенні — лише з цієї машини
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def _admin_denied(request: Request) -> Optional[JSONResponse]:
+    if ADMIN_TOKEN:
+        if hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+            return None
+    elif request.client and request.client.host in ("127.0.0.1", "::1"):
+        return None
+    return JSONResponse({"error": "admin token required"}, status_code=403)
+
+class IngestRequest(BaseModel):
+    name: str
+
+@app.post("/ingest")
+async def ingest(body: IngestRequest, request: Request):
+    """Поставити вже збережений у docs/ PDF у чергу індексації (так робить бот після on_doc)."""
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    name = docs_store.safe_name(body.name)
+    if not name or not name.lower().endswith(".pdf") or not os.path.isfile(os.path.join("docs", name)):
+        return JSONResponse({"error": "no such PDF in docs/"}, status_code=404)
+    return enqueue_ingest(name)
+
+@app.get("/ingest/status")
+def ingest_status(name: Optional[str] = None):
+    if name is not None:
+        job = ingest_jobs.get(name)
+        if job is None:
+            # при кількох воркерах задачу міг прийняти інший — тоді про неї знає сам індекс
+            idx = retriever_lite.current_index()
+            seg = idx.segments.get(name) if idx else None
+            if seg is not None:
+                job = {"name": name, "state": "searchable", "generation": idx.generation, "pages": seg.n_pages}
+        return job if job else JSONResponse({"error": "unknown document"}, status_code=404)
+    queued = [j["name"] for j in ingest_jobs.values() if j["state"] == "queued"]
+    return {"queue": queued, "jobs": list(ingest_jobs.values())}
+
+@app.post("/index/reload")
+async def index_reload(request: Request):
+    """Синхронізувати індекс з docs/ і опублікувати нове покоління; решта воркерів
+    перейде на нього протягом INDEX_RELOAD_CHECK секунд, запити в роботі дочитують старе."""
+    denied = _admin_denied(request)
+    if denied:
+        return denied
+    loop = asyncio.get_running_loop()
+    idx = await loop.run_in_executor(_ingest_pool, retriever_lite.reload_index)
+    return {"generation": idx.generation, "pages": len(idx), "segments": len(idx.segments)}
+
+def _warm():
+    try:
+        retriever_lite.ensure_index().warm()
+    except Exception as e:
+        print(f"[warn] index warm-up: {e}", flush=True)
+        return
+    _mark("index_ready")
+
+@app.on_event("startup")
+async def warm_index():
+    # індекс відкривається (зі store/ чи знімка) і прогрівається у фоні: старт воркера не чекає,
+    # перший пошук не платить ні за відкриття, ні за холодний кеш
+    asyncio.get_running_loop().run_in_executor(_ingest_pool, _warm)
+
+metrics.gauge("ingest_jobs", "Ingestion jobs by state", lambda: dict(
+    Counter(j["state"] for j in ingest_jobs.values())), ("state",))
+
+# ---------- пошук ----------
+# BM25 рахується в окремому пулі потоків, щоб /health не чекав на важкі запити
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "2"))
+SEARCH_QUEUE = int(os.getenv("SEARCH_QUEUE", "16"))      # максимум запитів у роботі та в черзі
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "5"))
+SEARCH_MAX_BATCH = 200
+
+_search_pool = ThreadPoolExecutor(SEARCH_WORKERS, thread_name_prefix="search")
+_search_inflight = 0
+metrics.gauge("search_inflight", "Search requests running or queued in the pool", lambda: _search_inflight)
+
+def _release(_):
+    global _search_inflight
+    _search_inflight -= 1
+
+async def _run_search(fn, *args):
+    """Виконує fn у пулі пошуку. None -> черга повна (429), TimeoutError -> час вичерпано."""
+    global _search_inflight
+    if _search_inflight >= SEARCH_QUEUE:
+        return None
+    _search_inflight += 1
+    fut = asyncio.get_running_loop().run_in_executor(_search_pool, fn, *args)
+    # слот звільняється, лише коли потік справді закінчив, а не коли клієнт перестав чекати
+    fut.add_done_callback(_release)
+    return await asyncio.wait_for(asyncio.shield(fut), SEARCH_TIMEOUT)
+
+def _hits(results):
+    hits = []
+    for m in results:
+        if m["score"] <= 0:
+            continue
+        name = os.path.basename(m["source_path"])
+        hits.append({
+            "doc_id": m["doc_id"],
+            "page": m["page"],
+            "snippet": m["text"],
+            "highlights": m["highlights"],
+            "score": m["score"],
+            "url": f"/files/{quote(name)}#page={m['page']}",
+            "page_url": f"/pages/{quote(name)}?p={m['page']}",
+        })
+    return hits
+
+def _search_one(q: str, k: int, fuzzy: Optional[bool]):
+    idx = retriever_lite.ensure_index()
+    out = {"query": q, "results": _hits(idx.search(q, k, fuzzy))}
+    if retriever_lite.FUZZY_SEARCH if fuzzy is None else fuzzy:
+        out["corrections"] = idx.corrections(q)
+    return out
+
+def _search_batch(queries: List[str], k: int, fuzzy: Optional[bool]):
+    return [_hits(r) for r in retriever_lite.ensure_index().search_many(queries, k, fuzzy)]
+
+async def _respond(fn, *args):
+    try:
+        res = await _run_search(fn, *args)
+    except asyncio.TimeoutError:
+        return JSONResponse({"error": "search timed out"}, status_code=504)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
+    if res is None:
+        return JSONResponse({"error": "search queue is full"}, status_code=429, headers={"Retry-After": "1"})
+    _mark("first_query")
+    return res
+
+# fuzzy: розширювати слова з одруківками (типово — FUZZY_SEARCH)
+@app.get("/search")
+async def search(q: str = Query(..., min_length=1), k: int = Query(6, ge=1, le=50),
+                 fuzzy: Optional[bool] = Query(None)):
+    return await _respond(_search_one, q, k, fuzzy)
+
+class BatchSearch(BaseModel):
+    queries: List[str]
+    k: int = 6
+    fuzzy: Optional[bool] = None
+
+@app.post("/search")
+async def search_batch(body: BatchSearch):
+    if not body.queries or len(body.queries) > SEARCH_MAX_BATCH or not 1 <= body.k <= 50:
+        return JSONResponse({"error": f"need 1..{SEARCH_MAX_BATCH} queries and 1 <= k <= 50"}, status_code=400)
+    res = await _respond(_search_batch, body.queries, body.k, body.fuzzy)
+    if isinstance(res, JSONResponse):
+        return res
+    return {"results": [{"query": q, "results": r} for q, r in zip(body.queries, res)]}
@@ -0,0 +1,121 @@
+"""Знімок індексу для швидкого холодного старту: сегменти всіх PDF з docs/, зібрані й перевірені
+заздалегідь — під час docker build або перед деплоєм. На старті ensure_index() докопіює в store/
+ті з них, яких там бракує, тож перший запит не чекає, поки прочитаються PDF.
+
+    python snapshot.py build --docs docs --out snapshot --workers 4
+    python snapshot.py verify snapshot
+
+Повторна збірка в той самий каталог перечитує лише нові або змінені PDF.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+
+import retriever_lite as R
+
+def _check(idx: "R.LiteIndex") -> List[str]:
+    """Кожен сегмент, відкритий з диска: формат і вікно поточні, словник, постинги й текст сторінок
+    узгоджені, а найрідші слова першої непорожньої сторінки знаходять документ. -> список проблем."""
+    problems = []
+    for si, seg in enumerate(idx._segs):
+        if seg.stale():
+            problems.append(f"{seg.name}: stale segment")
+            continue
+        for row in range(seg.n_pages):
+            toks = R.tokenize(seg.text(row))
+            if toks:
+                break
+        else:
+            continue       # PDF без тексту (скан) — шукати в ньому нічого
+        _, tids = idx.lookup(toks[0])
+        docs = seg.postings(tids[si])[0] if si in tids else []
+        if not any(seg.psg_page[d] == row for d in docs):
+            problems.append(f"{seg.name}: term {toks[0]!r} of page {int(seg.pages[row])} has no postings")
+            continue
+        rare = sorted(set(toks), key=lambda t: idx.lookup(t)[0])[:3]    # найрідші слова сторінки
+        if not any(m["doc_id"] == os.path.splitext(seg.name)[0] for m in idx._search(rare, 10)):
+            problems.append(f"{seg.name}: not found by its own text")
+    return problems
+
+def build(docs: str, out: str, workers: int) -> Dict:
+    t0 = time.perf_counter()
+    seg_dir = os.path.join(out, "segments")
+    os.makedirs(seg_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix="snapshot-")
+    # індекс збирається звичайним build_index, але в каталог знімка, а не в store/
+    R.DOCS_DIR, R.SEGMENTS_DIR, R.INDEX_SNAPSHOT_DIR = docs, seg_dir, ""
+    R.INDEX_PATH, R.INDEX_LOCK_PATH = os.path.join(tmp, "lite_index.json"), os.path.join(tmp, "index.lock")
+    R.LEGACY_INDEX_PATH = os.path.join(tmp, "lite_index.pkl")
+    # компактування (прибирає сегменти PDF, яких уже нема в docs/) — тут же, а не у фоні;
+    # триграми знімку не потрібні
+    R.schedule_compact, R.FUZZY_SEARCH = R.compact, False
+    try:
+        idx = R.build_index(workers=workers)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    segments = {}
+    for name, seg in idx.segments.items():
+        if seg.failed:
+            print(f"[warn] {name}: unreadable PDF, left out of the snapshot")
+            continue
+        segments[name] = R.Segment.open(R._segment_path(seg.sha1), name, seg.sha1, seg.mtime, seg.size)
+    problems = _check(R.LiteIndex(segments))
+    if problems:
+        raise SystemExit("[snapshot] verification failed:\n  " + "\n  ".join(problems))
+
+    data = {
+        "version": R.SNAPSHOT_VERSION, "seg_version": R.SEG_VERSION,
+        "window": [R.PASSAGE_TOKENS, R.PASSAGE_STRIDE], "positions": R.INDEX_POSITIONS,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "segments": [{"name": s.name, "sha1": s.sha1, "pages": s.n_pages, "bytes": s.nbytes,
+                      "sha256": R.file_sha256(R._segment_path(s.sha1))} for s in segments.values()],
+    }
+    R._atomic_write(os.path.join(out, R.SNAPSHOT_MANIFEST), json.dumps(data, ensure_ascii=False, indent=1).encode())
+    return {"segments": len(segments), "pages": sum(s.n_pages for s in segments.values()),
+            "mb": round(sum(s.nbytes for s in segments.values()) / 2**20, 2),
+            "seconds": round(time.perf_counter() - t0, 2)}
+
+def verify(root: str) -> List[str]:
+    data = R.read_snapshot(root)
+    if data is None:
+        return [f"{root}: no snapshot for this build"]
+    problems, segments = [], {}
+    for s in data["segments"]:
+        path = os.path.join(root, "segments", f"{s['sha1']}.seg")
+        try:
+            if R.file_sha256(path) != s["sha256"]:
+                raise ValueError("checksum mismatch")
+            segments[s["name"]] = R.Segment.open(path, s["name"], s["sha1"])
+        except Exception as e:
+            problems.append(f"{s['name']}: {e}")
+    return problems + _check(R.LiteIndex(segments))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prebuilt retriever_lite index snapshot")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build")
+    p.add_argument("--docs", default=R.DOCS_DIR)
+    p.add_argument("--out", default=R.INDEX_SNAPSHOT_DIR or "snapshot")
+    p.add_argument("--workers", type=int, default=R.INDEX_WORKERS)
+    p = sub.add_parser("verify")
+    p.add_argument("dir", nargs="?", default=R.INDEX_SNAPSHOT_DIR or "snapshot")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        print(f"[snapshot] {build(args.docs, args.out, args.workers)} -> {args.out}")
+    else:
+        problems = verify(args.dir)
+        for p in problems:
+            print(f"[snapshot] {p}")
+        if problems:
+            sys.exit(1)
+        print(f"[snapshot] {args.dir}: ok")
+
+if __name__ == "__main__":
+    main()